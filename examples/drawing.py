@@ -6,6 +6,8 @@ from libremarkable import WaveformMode
 
 fb.set_color("white")
 fb.update_full(WaveformMode.HighQualityGrayscale, sync=True)
+fb.track_damage()
+fb.start_update_queue()
 
 black = fb.getcolor("black")
 for event in Input.events(block=True):
@@ -31,4 +33,4 @@ for event in Input.events(block=True):
         else None
     ) or (x2, y2)
     fb.draw_line(x1, y1, x2, y2, black)
-    fb.update(x1, y1, x2 - x1 + 1, y2 - y1 + 1, WaveformMode.Mono)
+    fb.flush(WaveformMode.Mono)
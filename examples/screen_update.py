@@ -1,5 +1,7 @@
 import time
 
+from itertools import product
+
 from contextlib import contextmanager
 
 from PIL import Image
@@ -44,9 +46,7 @@ with performance_log("Total"):
         fb.set_rect(210, 210, 100, 100, "white")
 
     with performance_log("Checkboard dots"):
-        for y in range(210, 310, 2):
-            for x in range(210, 310, 2):
-                fb.set_pixel(x, y, "black")
+        fb.set_pixels(product(range(210, 310, 2), repeat=2), "black")
 
     with performance_log("Screen Update"):
         fb.update(210, 210, 310, 310, WaveformMode.Mono)
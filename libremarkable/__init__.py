@@ -6,14 +6,19 @@ from ._input import Event
 from ._input import TouchEvent
 from ._input import WacomEvent
 from ._input import KeyEvent
+from ._input import DeviceInfo
 from ._input import DEFAULT_KEYMAP
 
+from ._inputreader import InputReader
+
 from ._framebuffer import FrameBuffer
 from ._framebuffer import WaveformMode
 from ._framebuffer import DEFAULT_FONT_SIZE
 
 from ._color import color_t
 
+from ._surface import Surface
+
 
 FrameBuffer = FrameBuffer()  # Must be done to expose __setitem__
 
@@ -25,9 +30,12 @@ __all__ = [
     "TouchEvent",
     "WacomEvent",
     "KeyEvent",
+    "DeviceInfo",
+    "InputReader",
     "FrameBuffer",
     "WaveformMode",
     "color_t",
+    "Surface",
     "DEFAULT_KEYMAP",
     "DEFAULT_FONT_SIZE",
 ]
@@ -2,6 +2,8 @@ from ctypes import c_ushort as color_t  # Aliased to allow changing easily
 
 from PIL import ImageColor
 
+IMAGE_MODE = "I;16"
+
 _rgb8_to_5_lut = []
 for x in range(0, 256):
     _rgb8_to_5_lut.insert(x, (x >> 3) & 0x1F)
@@ -0,0 +1,47 @@
+import struct
+
+from array import array
+
+from fcntl import ioctl
+
+from evdev.ecodes import KEY_CNT
+
+from ._ioctl import _IOC
+from ._ioctl import _IOC_READ
+from ._ioctl import _IOR
+
+# struct input_absinfo: value, minimum, maximum, fuzz, flat, resolution
+input_absinfo = struct.Struct("6i")
+
+
+def EVIOCGKEY(size: int) -> int:
+    return _IOC(_IOC_READ, "E", 0x18, size)
+
+
+def EVIOCGABS(code: int) -> int:
+    return _IOR("E", 0x40 + code, input_absinfo.size)
+
+
+def EVIOCGMTSLOTS(size: int) -> int:
+    return _IOC(_IOC_READ, "E", 0x0A, size)
+
+
+def keys(fd: int) -> bytearray:
+    """Bitmask of the keys that are currently pressed"""
+    data = bytearray((KEY_CNT + 7) // 8)
+    ioctl(fd, EVIOCGKEY(len(data)), data)
+    return data
+
+
+def abs_value(fd: int, code: int) -> int:
+    data = bytearray(input_absinfo.size)
+    ioctl(fd, EVIOCGABS(code), data)
+    return input_absinfo.unpack(data)[0]
+
+
+def mt_values(fd: int, code: int, slots: int) -> array:
+    """Current value of a multitouch axis for each slot"""
+    # The kernel reads the code from the first entry and fills in the rest
+    data = array("i", [code] + [0] * slots)
+    ioctl(fd, EVIOCGMTSLOTS(data.itemsize * len(data)), data)
+    return data[1:]
@@ -1,6 +1,8 @@
 import os
+import asyncio
 
 from collections.abc import Iterable
+from collections.abc import Sequence
 
 from bresenham import bresenham
 
@@ -13,18 +15,24 @@ from mmap import ACCESS_DEFAULT
 
 from ctypes import sizeof
 
+from threading import Lock
+from threading import local
+
 from contextlib import contextmanager
 
 from PIL import Image
 from PIL import ImageColor
-from PIL import ImageDraw
-from PIL import ImageFont
 
 from . import _mxcfb
 from . import _rm2fb
+from . import _simfb
+from . import _raster
+from . import _text
+from . import instrumentation
 
 from ._color import color_t
 from ._color import getrgb
+from ._color import IMAGE_MODE
 
 from ._device import DeviceType
 from ._device import current
@@ -35,15 +43,38 @@ from ._mxcfb import UPDATE_MODE_FULL
 from ._mxcfb import mxcfb_update_data
 from ._mxcfb import TEMP_USE_REMARKABLE_DRAW
 
-IMAGE_MODE = "I;16"
+from ._updatequeue import UpdateQueue
+
+from ._surface import Surface
+from ._surface import PIXEL_FORMAT
+from ._surface import _copy_rows
+from ._surface import _move_rows
+from ._surface import _clip_source
+
+from .geometry import Point
+from .geometry import Damage
+from .geometry import Rect
+from .geometry import Region
+
 DEFAULT_FONT_SIZE = 24
+# What flush() counts each update as costing on top of its area, in pixels, and
+# the most updates it sends before falling back to one covering everything
+UPDATE_OVERHEAD = 4096
+MAX_DAMAGE_RECTS = 32
 
 _fb = None
 _marker = 0
+_marker_lock = Lock()
+_damage = None
+_queue = None
+_structs = local()
 
 
 def implementation():
     # As these may change at runtime, they are methods instead of stored at startup
+    if _simfb.enabled():
+        return _simfb
+
     if current == DeviceType.RM1:
         return _mxcfb
 
@@ -63,6 +94,73 @@ def _set_line_to_data(x: int, y: int, data) -> None:
     ] = data
 
 
+def _written(
+    left: int, top: int, right: int, bottom: int, pixels: int | None = None
+) -> None:
+    # Called after every write to the framebuffer with the area it covered
+    if instrumentation.collector is not None:
+        instrumentation.collector.add_pixels(
+            (right - left) * (bottom - top) if pixels is None else pixels
+        )
+
+    if _damage is not None and left < right and top < bottom:
+        _damage.add(Rect(left, top, right, bottom))
+
+
+def _next_markers(count: int = 1) -> int:
+    """Reserve count consecutive markers and return the first one"""
+    global _marker
+    with _marker_lock:
+        first = _marker + 1
+        _marker += count
+
+    return first
+
+
+def _update_structs(count: int) -> list[mxcfb_update_data]:
+    """Per-thread update structs that are reused between calls. Backends and
+    the update queue copy what they are given before returning"""
+    pool = getattr(_structs, "pool", None)
+    if pool is None:
+        pool = _structs.pool = []
+
+    while len(pool) < count:
+        pool.append(mxcfb_update_data())
+
+    return pool
+
+
+def _fill_update(
+    data: mxcfb_update_data,
+    x: int,
+    y: int,
+    width: int,
+    height: int,
+    waveform: WaveformMode,
+    partial: bool,
+    marker: int,
+) -> None:
+    region = data.update_region
+    region.left = x
+    region.top = y
+    region.width = width
+    region.height = height
+    data.waveform_mode = waveform
+    data.update_mode = UPDATE_MODE_PARTIAL if partial else UPDATE_MODE_FULL
+    data.temp = TEMP_USE_REMARKABLE_DRAW
+    data.update_marker = marker
+
+
+def _color_value(color: color_t | str | int) -> int:
+    if isinstance(color, str):
+        return getrgb(color).value
+
+    if isinstance(color, color_t):
+        return color.value
+
+    return color
+
+
 def _ensure_fb():
     global _fb
     if _fb is None:
@@ -79,6 +177,33 @@ class FrameBuffer:
     def path():
         return implementation().path()
 
+    @classmethod
+    def simulate(
+        cls,
+        path: str | None = None,
+        width: int = 1404,
+        height: int = 1872,
+        virtual_width: int | None = None,
+        virtual_height: int | None = None,
+        x_offset: int = 0,
+        y_offset: int = 0,
+        dump_dir: str | None = None,
+        stride: int | None = None,
+    ) -> None:
+        cls.release()
+        _simfb.configure(
+            path,
+            width,
+            height,
+            virtual_width,
+            virtual_height,
+            x_offset,
+            y_offset,
+            dump_dir,
+            stride,
+        )
+        _simfb.setup()
+
     @classmethod
     def open(cls):
         return open(cls.path(), "r+b")
@@ -109,6 +234,11 @@ class FrameBuffer:
     def virtual_height() -> int:
         return implementation().virtual_height()
 
+    @staticmethod
+    def stride() -> int:
+        """Pixels from the start of one row to the next"""
+        return implementation().stride()
+
     @staticmethod
     def x_offset() -> int:
         return implementation().x_offset()
@@ -123,6 +253,11 @@ class FrameBuffer:
         global _fb
         if _fb is None:
             f = cls.open()
+            if implementation() is _mxcfb:
+                # Read the screen info through this file rather than opening
+                # the framebuffer again for it
+                _mxcfb.screen_info(f.fileno())
+
             size = cls.size()
             mm = mmap(
                 f.fileno(),
@@ -136,11 +271,16 @@ class FrameBuffer:
                 "f": f,
                 "mm": mm,
                 "data": (color_t * int(size / sizeof(color_t))).from_buffer(mm),
+                "view": memoryview(mm).cast(PIXEL_FORMAT),
                 "offset": offset,
                 "image": Image.frombuffer(
                     IMAGE_MODE,
                     (cls.virtual_width(), cls.virtual_height()),
                     mm,
+                    "raw",
+                    IMAGE_MODE,
+                    cls.stride() * cls.pixel_size(),
+                    1,
                 ),
             }
 
@@ -153,6 +293,7 @@ class FrameBuffer:
             _fb["image"].close()
             del _fb["data"]
             _fb["data"] = None
+            _fb["view"].release()
             _fb["mm"].close()
             _fb["f"].close()
             _fb = None
@@ -170,24 +311,60 @@ class FrameBuffer:
         sync=False,
     ) -> int:
         if marker is None:
-            global _marker
-            marker = _marker = _marker + 1
-
-        data = mxcfb_update_data()
-        data.update_region.left = x
-        data.update_region.top = y
-        data.update_region.width = width
-        data.update_region.height = height
-        data.waveform_mode = waveform
-        data.update_mode = UPDATE_MODE_PARTIAL if partial else UPDATE_MODE_FULL
-        data.temp = TEMP_USE_REMARKABLE_DRAW
-        data.update_marker = marker
-        implementation().update(data)
+            marker = _next_markers()
+
+        data = _update_structs(1)[0]
+        _fill_update(data, x, y, width, height, waveform, partial, marker)
+        if _queue is not None:
+            _queue.put(data)
+
+        else:
+            implementation().update(data)
+
         if sync:
             cls.wait(data.update_marker)
 
         return data.update_marker
 
+    @classmethod
+    def update_many(
+        cls,
+        updates: Iterable[tuple[Rect, WaveformMode]],
+        partial=True,
+        sync=False,
+        nowait=False,
+    ) -> list[int]:
+        """Submit a burst of updates and return the markers of the ones sent.
+        With nowait the burst stops once the display's queue is full instead of
+        blocking, so any updates past the returned markers need to be retried"""
+        updates = list(updates)
+        batch = _update_structs(len(updates))[: len(updates)]
+        marker = _next_markers(len(updates))
+        for data, (rect, waveform) in zip(batch, updates):
+            left, top, right, bottom = rect.toInt()
+            _fill_update(
+                data, left, top, right - left, bottom - top, waveform, partial, marker
+            )
+            marker += 1
+
+        if _queue is not None:
+            for data in batch:
+                _queue.put(data)
+
+            sent = len(batch)
+
+        else:
+            sent = implementation().update_many(batch, nowait)
+
+        markers = [x.update_marker for x in batch[:sent]]
+        if sync and markers:
+            # Updates complete in the order they were submitted, so the last
+            # one finishing means the whole burst has. With the update queue
+            # this waits on whatever the last update was merged into
+            cls.wait(markers[-1])
+
+        return markers
+
     @classmethod
     def update_full(cls, waveform: WaveformMode, marker: int = None, sync=False):
         cls.update(
@@ -202,13 +379,77 @@ class FrameBuffer:
         )
 
     @staticmethod
-    def wait(marker: int) -> None:
-        implementation().wait(marker)
+    def wait(marker: int, timeout: float | None = None) -> None:
+        if _queue is not None:
+            _queue.flush()
+            marker = _queue.resolve(marker)
+
+        implementation().wait(marker, timeout)
+
+    @staticmethod
+    def poll(marker: int) -> bool:
+        """Check if the update for marker has been displayed without blocking"""
+        if _queue is not None:
+            _queue.flush()
+            marker = _queue.resolve(marker)
+
+        return implementation().poll(marker)
+
+    @classmethod
+    async def wait_async(cls, marker: int, timeout: float | None = None) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, cls.wait, marker, timeout)
+
+    @staticmethod
+    def start_update_queue(latency_ms: float = 20) -> UpdateQueue:
+        global _queue
+        if _queue is None:
+            _queue = UpdateQueue(lambda data: implementation().update(data))
+
+        _queue.latency_ms = latency_ms
+        _queue.start()
+        return _queue
+
+    @staticmethod
+    def stop_update_queue() -> None:
+        global _queue
+        if _queue is not None:
+            queue, _queue = _queue, None
+            queue.stop()
+
+    @staticmethod
+    def track_damage(enabled: bool = True) -> None:
+        global _damage
+        if not enabled:
+            _damage = None
+
+        elif _damage is None:
+            _damage = Damage(UPDATE_OVERHEAD, MAX_DAMAGE_RECTS)
+
+    @staticmethod
+    def damage() -> Region:
+        return Region(*_damage) if _damage is not None else Region()
+
+    @classmethod
+    def flush(
+        cls,
+        waveform: WaveformMode,
+        partial=True,
+        sync=False,
+    ) -> list[int]:
+        if not _damage:
+            return []
+
+        rects = sorted(_damage)
+        _damage.clear()
+        return cls.update_many(
+            [(rect, waveform) for rect in rects], partial=partial, sync=sync
+        )
 
     @classmethod
     def get_row_offset(cls, y: int) -> int:
         assert 0 <= y <= cls.height()
-        return (y + cls.y_offset()) * cls.virtual_width()
+        return (y + cls.y_offset()) * cls.stride()
 
     @classmethod
     def get_offset(cls, x: int, y: int) -> int:
@@ -222,6 +463,62 @@ class FrameBuffer:
             color = cls.getcolor(color)
 
         _ensure_fb()["data"][cls.get_offset(x, y)] = color
+        _written(x, y, x + 1, y + 1)
+
+    @classmethod
+    def set_pixels(
+        cls,
+        points: Iterable[tuple[int, int] | Point],
+        color: color_t | str | int,
+    ) -> None:
+        points = [tuple(x) for x in points]
+        if not points:
+            return
+
+        xs, ys = zip(*points)
+        cls.set_pixels_xy(xs, ys, color)
+
+    @classmethod
+    def set_pixels_xy(
+        cls,
+        xs: Sequence[int],
+        ys: Sequence[int],
+        colors: color_t | str | int | Sequence[color_t | str | int],
+    ) -> None:
+        assert len(xs) == len(ys), "xs and ys must be the same length"
+        if not len(xs):
+            return
+
+        if isinstance(colors, str):
+            colors = cls.getcolor(colors)
+
+        if isinstance(colors, color_t):
+            colors = colors.value
+
+        left, right = min(xs), max(xs)
+        top, bottom = min(ys), max(ys)
+        assert 0 <= left and right < cls.width(), "x not within bounds"
+        assert 0 <= top and bottom < cls.height(), "y not within bounds"
+        if hasattr(xs, "__array__") or hasattr(ys, "__array__"):
+            # Vectorized path for numpy arrays
+            if not isinstance(colors, int) and not hasattr(colors, "__array__"):
+                colors = [_color_value(x) for x in colors]
+
+            cls.as_array()[ys, xs] = colors
+
+        else:
+            view = _ensure_fb()["view"]
+            stride = cls.stride()
+            offset = cls.get_offset(0, 0)
+            if isinstance(colors, int):
+                for x, y in zip(xs, ys):
+                    view[offset + y * stride + x] = colors
+
+            else:
+                for x, y, color in zip(xs, ys, colors, strict=True):
+                    view[offset + y * stride + x] = _color_value(color)
+
+        _written(left, top, right + 1, bottom + 1, len(xs))
 
     @classmethod
     def get_pixel(cls, x: int, y: int) -> int:
@@ -236,6 +533,7 @@ class FrameBuffer:
 
         data = (color_t * width).from_buffer(bytearray(color) * width)
         _set_line_to_data(x, y, data)
+        _written(x, y, x + width, y + 1)
 
     @classmethod
     def get_row(cls, x: int, y: int, width: int) -> tuple[int]:
@@ -267,6 +565,7 @@ class FrameBuffer:
         if isinstance(color, str):
             color = cls.getcolor(color)
 
+        _written(left, top, left + width, top + height)
         data = (color_t * width).from_buffer(bytearray(color) * width)
         for y in range(top, top + height):
             _set_line_to_data(left, y, data)
@@ -311,11 +610,102 @@ class FrameBuffer:
         if image.mode != IMAGE_MODE:
             image = image.convert(IMAGE_MODE)
 
-        data = (color_t * (image.width * image.height)).from_buffer_copy(
-            image.tobytes()
+        _copy_rows(
+            _ensure_fb()["view"],
+            cls.get_offset(left, top),
+            cls.stride(),
+            memoryview(image.tobytes()).cast(PIXEL_FORMAT),
+            0,
+            width,
+            width,
+            height,
+        )
+        _written(left, top, left + width, top + height)
+
+    @classmethod
+    def blit(
+        cls,
+        surface: Surface,
+        x: int,
+        y: int,
+        src_rect: Rect | None = None,
+    ) -> None:
+        left, top, width, height = _clip_source(surface, src_rect)
+        assert 0 <= x <= cls.width() - width, f"x of {x} is invalid"
+        assert 0 <= y <= cls.height() - height, f"y of {y} is invalid"
+        _copy_rows(
+            _ensure_fb()["view"],
+            cls.get_offset(x, y),
+            cls.stride(),
+            surface.data,
+            top * surface.width + left,
+            surface.width,
+            width,
+            height,
+        )
+        _written(x, y, x + width, y + height)
+
+    @classmethod
+    def copy_rect(cls, src: Rect, dst: Point) -> None:
+        left, top, right, bottom = src.toInt()
+        x, y = dst.toInt()
+        width = right - left
+        height = bottom - top
+        assert 0 <= left < right <= cls.width(), f"{src} is invalid"
+        assert 0 <= top < bottom <= cls.height(), f"{src} is invalid"
+        assert 0 <= x <= cls.width() - width, f"x of {x} is invalid"
+        assert 0 <= y <= cls.height() - height, f"y of {y} is invalid"
+        _move_rows(
+            _ensure_fb()["view"],
+            cls.get_offset(left, top),
+            cls.get_offset(x, y),
+            cls.stride(),
+            width,
+            height,
         )
-        for y in range(0, image.height):
-            _set_line_to_data(left, top + y, data[y * width : y * width + width])
+        _written(x, y, x + width, y + height)
+
+    @classmethod
+    def scroll(
+        cls,
+        rect: Rect,
+        dx: int,
+        dy: int,
+        fill: color_t | str | None = None,
+    ) -> None:
+        left, top, right, bottom = rect.toInt()
+        width = right - left
+        height = bottom - top
+        moved = abs(dx) < width and abs(dy) < height
+        if moved:
+            cls.copy_rect(
+                Rect(
+                    left + max(-dx, 0),
+                    top + max(-dy, 0),
+                    right - max(dx, 0),
+                    bottom - max(dy, 0),
+                ),
+                Point(left + max(dx, 0), top + max(dy, 0)),
+            )
+
+        if fill is None:
+            return
+
+        if isinstance(fill, str):
+            fill = cls.getcolor(fill)
+
+        if not moved:
+            cls.set_rect(left, top, width, height, fill)
+            return
+
+        # Fill the area that was scrolled into view
+        if dy:
+            size = abs(dy)
+            cls.set_rect(left, top if dy > 0 else bottom - size, width, size, fill)
+
+        if dx:
+            size = abs(dx)
+            cls.set_rect(left if dx > 0 else right - size, top, size, height, fill)
 
     @classmethod
     def draw_text(
@@ -327,6 +717,7 @@ class FrameBuffer:
         text: str,
         color: color_t | str = "black",
         fontSize: int = DEFAULT_FONT_SIZE,
+        font: str | None = None,
     ):
         image = cls.to_image(left, top, width, height)
         if isinstance(color, str):
@@ -336,14 +727,7 @@ class FrameBuffer:
             # TODO - handle when IMAGE_MODE has more bands
             color = color.value
 
-        d = ImageDraw.Draw(image)
-        d.fontmode = "L"
-        d.text(
-            (0, 0),
-            text,
-            color,
-            font=ImageFont.load_default(size=fontSize),
-        )
+        _text.draw_text(image, (0, 0), text, color, fontSize, font)
         cls.draw_image(left, top, image)
 
     @classmethod
@@ -357,6 +741,7 @@ class FrameBuffer:
         color: color_t | str = "black",
         fontSize: int = DEFAULT_FONT_SIZE,
         align: str = "left",
+        font: str | None = None,
     ):
         image = cls.to_image(left, top, width, height)
         if isinstance(color, str):
@@ -366,16 +751,17 @@ class FrameBuffer:
             # TODO - handle when IMAGE_MODE has more bands
             color = color.value
 
-        d = ImageDraw.Draw(image)
-        d.fontmode = "L"
-        d.multiline_text(
-            (0, 0),
-            text,
-            color,
-            font=ImageFont.load_default(size=fontSize),
-        )
+        _text.draw_multiline_text(image, (0, 0), text, color, fontSize, font, align)
         cls.draw_image(left, top, image)
 
+    @staticmethod
+    def text_cache_info() -> dict:
+        return _text.cache_info()
+
+    @staticmethod
+    def clear_text_cache() -> None:
+        _text.cache_clear()
+
     @classmethod
     def to_image(
         cls,
@@ -399,6 +785,21 @@ class FrameBuffer:
         top += cls.y_offset()
         return _ensure_fb()["image"].crop((left, top, left + width, top + height))
 
+    @classmethod
+    def as_array(cls):
+        # Requires numpy, the array shares memory with the mmap so it must be
+        # deleted before release() is called
+        import numpy
+
+        stride = cls.stride()
+        height = cls.virtual_height()
+        data = numpy.frombuffer(
+            _ensure_fb()["mm"], dtype=numpy.uint16, count=stride * height
+        ).reshape(height, stride)
+        left = cls.x_offset()
+        top = cls.y_offset()
+        return data[top : top + cls.height(), left : left + cls.width()]
+
     @staticmethod
     def getcolor(name_or_hex: str) -> color_t:
         return getrgb(name_or_hex)
@@ -468,11 +869,13 @@ class FrameBuffer:
                     startValueOffset:stopValueOffset:step
                 ]
                 startValueOffset += size
+                _written(startX, y, endX, y + 1)
 
         elif isinstance(key, int):
             assert isinstance(value, color_t) or isinstance(value, str)
             y = int(key / cls.width())
             f["data"][cls.get_offset(key - y, y)] = value
+            _written(key - y, y, key - y + 1, y + 1)
 
         else:
             raise NotImplementedError()
@@ -503,5 +906,33 @@ class FrameBuffer:
     def draw_line(
         cls, x1: int, y1: int, x2: int, y2: int, color: color_t | str
     ) -> None:
-        for x, y in bresenham(x1, y1, x2, y2):
-            cls.set_pixel(x, y, color)
+        cls.set_pixels(bresenham(x1, y1, x2, y2), color)
+
+    @classmethod
+    def draw_polyline(
+        cls,
+        points: Iterable[tuple[int, int] | Point],
+        color: color_t | str,
+        width: int = 1,
+        cap: str = "round",
+        join: str = "round",
+    ) -> Rect | None:
+        """Draw a stroke through points and return the area it touched, or None
+        if nothing was drawn. The Rect can be passed to update_many(), update()
+        takes its left, top, width and height instead"""
+        spans = _raster.polyline_spans(
+            points, cls.width(), cls.height(), width, cap, join
+        )
+        rect = _raster.spans_rect(spans)
+        if rect is None:
+            return None
+
+        _raster.fill_spans(
+            _ensure_fb()["view"],
+            cls.get_offset(0, 0),
+            cls.stride(),
+            spans,
+            _color_value(color),
+        )
+        _written(*rect, _raster.spans_pixels(spans))
+        return rect
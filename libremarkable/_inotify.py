@@ -0,0 +1,58 @@
+import os
+import struct
+
+from ctypes import get_errno
+
+from ._libc import inotify_init1
+from ._libc import inotify_add_watch
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Non-blocking inotify instance watching a single directory, usable with
+    selectors and loop.add_reader"""
+
+    def __init__(self, path: str, mask: int):
+        self.fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = get_errno()
+            raise OSError(err, os.strerror(err))
+
+        if inotify_add_watch(self.fd, path.encode("utf-8"), mask) < 0:
+            err = get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err), path)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def read(self) -> list[tuple[int, str]]:
+        """Return the (mask, name) of each pending event"""
+        try:
+            data = os.read(self.fd, 4096)
+
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _HEADER.unpack_from(data, offset)
+            offset += _HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0").decode("utf-8")
+            offset += length
+            events.append((mask, name))
+
+        return events
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
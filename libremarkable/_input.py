@@ -1,18 +1,28 @@
-import math
+import os
+import asyncio
 
 from errno import ENODEV
 
-from copy import deepcopy
+from array import array
 
+from dataclasses import dataclass
+from dataclasses import field
+
+from typing import AsyncIterator
+from typing import Iterable
 from typing import Iterator
 
 from evdev import list_devices
 from evdev import InputDevice
 from evdev import InputEvent
+from evdev import AbsInfo
 
+from evdev.ecodes import ABS_CNT
+from evdev.ecodes import KEY_CNT
 from evdev.ecodes import EV_ABS
 from evdev.ecodes import EV_KEY
 from evdev.ecodes import EV_SYN
+from evdev.ecodes import EV_MSC
 from evdev.ecodes import ABS_X
 from evdev.ecodes import ABS_Y
 from evdev.ecodes import ABS_TILT_X
@@ -42,50 +52,169 @@ from ._device import current as deviceType
 
 from ._keymap import keymap as DEFAULT_KEYMAP
 
+from ._inotify import Inotify
+from ._inotify import IN_ATTRIB
+from ._inotify import IN_CREATE
+from ._inotify import IN_DELETE
 
-def _rotate(
-    *points: tuple[int, int], center: tuple[int, int], angle: int
-) -> tuple[int, int]:
-    cx, cy = center
-    angle = angle % 360
-    ang_rad = math.radians(angle)
-    cos_ang, sin_ang = (
-        (0, 1)
-        if angle == 90
-        else (-1, 0)
-        if angle == 180
-        else (0, -1)
-        if angle == 270
-        else (math.cos(ang_rad), math.sin(ang_rad))
-    )
-    ret = tuple(
-        (cx + cos_ang * dx - sin_ang * dy, cy + sin_ang * dx + cos_ang * dy)
-        for dx, dy in ((x - cx, y - cy) for x, y in points)
-    )
-    return ret if len(ret) > 1 else ret[0]
+from . import _evdev
+
+INPUT_PATH = "/dev/input"
+# Most events python-evdev returns from one InputDevice.read()
+READ_EVENTS = 64
+
+
+class _SlotState:
+    """Values reported for one slot, indexed by code. Codes that have never
+    been reported read as None"""
+
+    __slots__ = ("abs", "key", "other")
+
+    def __init__(self):
+        self.abs = [None] * ABS_CNT
+        # Key values offset by one so that 0 means never reported
+        self.key = None
+        self.other = None
+
+    def get(self, key: tuple[int, int], default=None):
+        type, code = key
+        if type == EV_ABS:
+            value = self.abs[code]
+            return default if value is None else value
+
+        if type == EV_KEY:
+            if self.key is None or not self.key[code]:
+                return default
+
+            return self.key[code] - 1
+
+        if self.other is None:
+            return default
+
+        return self.other.get(key, default)
+
+    def set(self, type: int, code: int, value: int) -> None:
+        if type == EV_ABS:
+            self.abs[code] = value
+
+        elif type == EV_KEY:
+            if self.key is None:
+                self.key = bytearray(KEY_CNT)
+
+            self.key[code] = value + 1
+
+        else:
+            if self.other is None:
+                self.other = {}
+
+            self.other[(type, code)] = value
+
+    def items(self) -> Iterator[tuple[tuple[int, int], int]]:
+        for code, value in enumerate(self.abs):
+            if value is not None:
+                yield (EV_ABS, code), value
+
+        if self.key is not None:
+            for code, value in enumerate(self.key):
+                if value:
+                    yield (EV_KEY, code), value - 1
+
+        if self.other is not None:
+            yield from self.other.items()
+
+    def copy(self) -> "_SlotState":
+        state = _SlotState.__new__(_SlotState)
+        state.abs = self.abs.copy()
+        state.key = None if self.key is None else self.key.copy()
+        state.other = None if self.other is None else self.other.copy()
+        return state
+
+
+_EMPTY = _SlotState()
+
+
+class _DeviceState:
+    """Current and previous values of each slot of a device. An event holds on
+    to both, so once it has been built neither is changed again: previous
+    becomes the state it saw, and current is copied before the next report
+    for that slot changes it"""
+
+    __slots__ = ("info", "type", "events", "slot", "current", "previous", "skipped")
+
+    def __init__(self, info: "DeviceInfo"):
+        self.info = info
+        self.type = info.type
+        self.events = []
+        self.slot = 0
+        self.current: dict[int, _SlotState] = {}
+        self.previous: dict[int, _SlotState] = {}
+        self.skipped: array | None = None
+
+    def advance(self) -> None:
+        self.events = []
+        current = self.current.get(self.slot)
+        if current is not None:
+            self.previous[self.slot] = current
+
+    def writable(self) -> _SlotState:
+        """State of the active slot that the next event can be applied to"""
+        current = self.current.get(self.slot)
+        if current is None:
+            current = self.current[self.slot] = _SlotState()
+
+        elif current is self.previous.get(self.slot):
+            # Still held by the last event for this slot
+            current = self.current[self.slot] = current.copy()
+
+        return current
 
 
 class Event:
+    __slots__ = (
+        "device",
+        "rawEvents",
+        "previousData",
+        "data",
+        "skipped",
+        "_info",
+        "_ranges",
+    )
+
     def __init__(self, device, state):
         self.device = device
-        self.rawEvents = state["events"]
-        self.previousData = state["previous"].get(state["slot"], {})
-        self.data = state["current"].get(state["slot"], {})
+        self.rawEvents = state.events
+        self.previousData = state.previous.get(state.slot, _EMPTY)
+        self.data = state.current.get(state.slot, _EMPTY)
+        # (code, value) pairs of the reports coalesced into this one
+        self.skipped = state.skipped
+        self._info = state.info
+        self._ranges = state.info.ranges
 
     def __repr__(self):
         return f"Event(rawEvents={len(self.rawEvents)})"
 
     def _get_abs_range(self, code) -> tuple[int, int]:
-        info = self.device.absinfo(code)
-        return info.min, info.max
+        range = self._ranges[code]
+        if range is None:
+            info = self.device.absinfo(code)
+            return info.min, info.max
+
+        return range[0], range[1]
+
+    def _normalize(self, code: int, value: int) -> float:
+        range = self._ranges[code]
+        if range is None:
+            min, max = self._get_abs_range(code)
+            return (value - min) / (max - min)
+
+        return (value - range[0]) * range[2]
 
     def _get_abs_float(self, type: int, code: int, default: int | None) -> float | None:
         value = self.data.get((type, code), None)
         if value is None:
             return default
 
-        min, max = self._get_abs_range(code)
-        return (value - min) / (max - min)
+        return self._normalize(code, value)
 
     def _get_previous_abs_float(
         self, type: int, code: int, default: int | None
@@ -94,11 +223,35 @@ class Event:
         if value is None:
             return default
 
-        min, max = self._get_abs_range(code)
-        return (value - min) / (max - min)
+        return self._normalize(code, value)
+
+    def _skippedScreenPos(self, codeX: int, codeY: int) -> list[tuple[int, int]]:
+        skipped = self.skipped
+        if not skipped:
+            return []
+
+        x = self.previousData.get((EV_ABS, codeX), None)
+        y = self.previousData.get((EV_ABS, codeY), None)
+        xs = []
+        ys = []
+        for i in range(0, len(skipped), 2):
+            code = skipped[i]
+            if code == codeX:
+                x = skipped[i + 1]
+
+            elif code == codeY:
+                y = skipped[i + 1]
+
+            elif code == -1 and x is not None and y is not None:
+                xs.append(x)
+                ys.append(y)
+
+        return list(zip(*self._info.transform.map(xs, ys)))
 
 
 class TouchEvent(Event):
+    __slots__ = ()
+
     def __init__(self, device, state):
         super().__init__(device, state)
         if self.previousTrackingId == -1:
@@ -110,16 +263,13 @@ class TouchEvent(Event):
             f"pressure={self.pressure} rawEvents={len(self.rawEvents)})"
         )
 
-    def _screenPos(self, x: int | None, y: int | None) -> tuple[int, int] | None:
+    def _screenPos(self, data: _SlotState) -> tuple[int, int] | None:
+        x = data.get((EV_ABS, ABS_MT_POSITION_X), None)
+        y = data.get((EV_ABS, ABS_MT_POSITION_Y), None)
         if x is None or y is None:
             return None
 
-        y = 1 - y
-        if deviceType == DeviceType.RM1:
-            x = 1 - x
-
-        maxX, maxY = fb.width() - 1, fb.height() - 1
-        return int(x * maxX), int(y * maxY)
+        return self._info.transform(x, y)
 
     @property
     def x(self) -> float | None:
@@ -131,7 +281,13 @@ class TouchEvent(Event):
 
     @property
     def screenPos(self) -> tuple[int, int] | None:
-        return self._screenPos(self.x, self.y)
+        return self._screenPos(self.data)
+
+    @property
+    def skippedScreenPos(self) -> list[tuple[int, int]]:
+        """Positions between previousScreenPos and screenPos that were dropped
+        by coalescing, oldest first. Only kept when reading with keepSkipped"""
+        return self._skippedScreenPos(ABS_MT_POSITION_X, ABS_MT_POSITION_Y)
 
     @property
     def pressure(self) -> float | None:
@@ -155,7 +311,7 @@ class TouchEvent(Event):
 
     @property
     def previousScreenPos(self) -> tuple[int, int] | None:
-        return self._screenPos(self.previousX, self.previousY)
+        return self._screenPos(self.previousData)
 
     @property
     def previousPressure(self) -> float | None:
@@ -167,6 +323,8 @@ class TouchEvent(Event):
 
 
 class WacomEvent(Event):
+    __slots__ = ()
+
     def __init__(self, device, state):
         super().__init__(device, state)
         if not self.was_down and not self.was_hover:
@@ -179,15 +337,13 @@ class WacomEvent(Event):
             f"rawEvents={len(self.rawEvents)})"
         )
 
-    def _screenPos(self, x: int | None, y: int | None) -> tuple[int, int] | None:
+    def _screenPos(self, data: _SlotState) -> tuple[int, int] | None:
+        x = data.get((EV_ABS, ABS_X), None)
+        y = data.get((EV_ABS, ABS_Y), None)
         if x is None or y is None:
             return None
 
-        if deviceType in (DeviceType.RM1, DeviceType.RM2):
-            x, y = _rotate((x, y), center=(0.5, 0.5), angle=270)
-
-        maxX, maxY = fb.width() - 1, fb.height() - 1
-        return int(x * maxX), int(y * maxY)
+        return self._info.transform(x, y)
 
     @property
     def x(self) -> float | None:
@@ -199,7 +355,13 @@ class WacomEvent(Event):
 
     @property
     def screenPos(self) -> tuple[int, int] | None:
-        return self._screenPos(self.x, self.y)
+        return self._screenPos(self.data)
+
+    @property
+    def skippedScreenPos(self) -> list[tuple[int, int]]:
+        """Positions between previousScreenPos and screenPos that were dropped
+        by coalescing, oldest first. Only kept when reading with keepSkipped"""
+        return self._skippedScreenPos(ABS_X, ABS_Y)
 
     @property
     def distance(self) -> float | None:
@@ -234,7 +396,7 @@ class WacomEvent(Event):
 
     @property
     def previousScreenPos(self) -> tuple[int, int] | None:
-        return self._screenPos(self.previousX, self.previousY)
+        return self._screenPos(self.previousData)
 
     @property
     def previousDistance(self) -> float | None:
@@ -261,6 +423,7 @@ class WacomEvent(Event):
 
 
 class KeyEvent(Event):
+    __slots__ = ()
     keymap: dict[int, tuple[str | None, str | None]] = DEFAULT_KEYMAP
 
     def __init__(self, device, state):
@@ -337,94 +500,370 @@ class KeyEvent(Event):
         return self.keymap[self.keycode][int(self.is_shift)]
 
 
+# (raw axis, multiplier, addend, divisor) of one screen axis
+_Axis = tuple[int, int, int, int]
+
+
+@dataclass(frozen=True)
+class ScreenTransform:
+    """Integer affine transform from raw positions to screen pixels. Each
+    screen axis is (raw * multiplier + addend) // divisor of one raw axis,
+    where raw axis 0 is x and 1 is y"""
+
+    x: _Axis
+    y: _Axis
+
+    @staticmethod
+    def _axis(source: int, min: int, max: int, size: int, flip: bool) -> _Axis:
+        span = (max - min) or 1
+        if flip:
+            return source, -size, max * size, span
+
+        return source, size, -min * size, span
+
+    @classmethod
+    def forDevice(cls, info: "DeviceInfo") -> "ScreenTransform":
+        if info.type == "touch":
+            codes = ABS_MT_POSITION_X, ABS_MT_POSITION_Y
+
+        else:
+            codes = ABS_X, ABS_Y
+
+        ranges = []
+        for code in codes:
+            range = info.ranges[code]
+            if range is None:
+                absinfo = info.device.absinfo(code)
+                range = absinfo.min, absinfo.max
+
+            ranges.append(range[:2])
+
+        (minX, maxX), (minY, maxY) = ranges
+        width, height = fb.width() - 1, fb.height() - 1
+        if info.type == "touch":
+            # Touch is upside down, and mirrored on the reMarkable 1
+            return cls(
+                cls._axis(0, minX, maxX, width, deviceType == DeviceType.RM1),
+                cls._axis(1, minY, maxY, height, True),
+            )
+
+        if deviceType in (DeviceType.RM1, DeviceType.RM2):
+            # The digitizer is rotated 270 degrees from the screen
+            return cls(
+                cls._axis(1, minY, maxY, width, False),
+                cls._axis(0, minX, maxX, height, True),
+            )
+
+        return cls(
+            cls._axis(0, minX, maxX, width, False),
+            cls._axis(1, minY, maxY, height, False),
+        )
+
+    def __call__(self, x: int, y: int) -> tuple[int, int]:
+        raw = (x, y)
+        source, mul, add, div = self.x
+        screenX = (raw[source] * mul + add) // div
+        source, mul, add, div = self.y
+        return screenX, (raw[source] * mul + add) // div
+
+    def map(self, xs, ys):
+        """Map sequences of raw x and y values, returning the screen x and y
+        values. numpy arrays are mapped in one vectorized step, anything else
+        is returned as lists"""
+        raw = (xs, ys)
+        if hasattr(xs, "__array__"):
+            return tuple(
+                (raw[source] * mul + add) // div
+                for source, mul, add, div in (self.x, self.y)
+            )
+
+        return tuple(
+            [(value * mul + add) // div for value in raw[source]]
+            for source, mul, add, div in (self.x, self.y)
+        )
+
+
+@dataclass
+class DeviceInfo:
+    """Capabilities and classification of an input device, read once when it
+    is first seen"""
+
+    device: InputDevice
+    identity: tuple[int, int]
+    capabilities: dict[int, frozenset[int]]
+    absinfo: dict[int, AbsInfo]
+    type: str
+    # (min, max, 1 / (max - min)) of each ABS code, so normalizing a value is
+    # a subtraction and a multiply
+    ranges: list[tuple[int, int, float] | None] = field(init=False, repr=False)
+    _transform: "ScreenTransform | None" = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.ranges = [None] * ABS_CNT
+        for code, info in self.absinfo.items():
+            span = info.max - info.min
+            self.ranges[code] = (info.min, info.max, 1 / span if span else 0.0)
+
+    @property
+    def transform(self) -> "ScreenTransform":
+        """Maps raw positions from this device to screen pixels, worked out
+        from the framebuffer size the first time it is used"""
+        if self._transform is None:
+            self._transform = ScreenTransform.forDevice(self)
+
+        return self._transform
+
+    @property
+    def path(self) -> str:
+        return self.device.path
+
+
+def _identity(stat: os.stat_result) -> tuple[int, int]:
+    # A node that is removed and created again gets a new inode
+    return stat.st_rdev, stat.st_ino
+
+
+def _classify(
+    capabilities: dict[int, frozenset[int]], absinfo: dict[int, AbsInfo]
+) -> str:
+    if EV_ABS not in capabilities:
+        return "key" if EV_KEY in capabilities else "unknown"
+
+    if ABS_MT_TRACKING_ID in absinfo and absinfo[ABS_MT_TRACKING_ID].max:
+        return "touch"
+
+    if BTN_STYLUS in capabilities.get(EV_KEY, ()):
+        return "wacom"
+
+    # TODO - add mouse and other pointer device support
+    return "unknown"
+
+
+class _Registry:
+    """Caches what is known about each device node. Only the metadata is
+    shared, every caller reads events from its own InputDevice"""
+
+    def __init__(self, path: str = INPUT_PATH, opener=InputDevice):
+        self.path = path
+        self.opener = opener
+        self.devices: dict[str, DeviceInfo] = {}
+        # Device last passed to get() for each path, so looking up the same
+        # one again doesn't need an fstat
+        self.seen: dict[str, InputDevice] = {}
+
+    def _add(self, device: InputDevice, identity: tuple[int, int]) -> DeviceInfo:
+        raw = device.capabilities(absinfo=True)
+        absinfo = dict(raw.get(EV_ABS, []))
+        capabilities = {
+            type: frozenset(absinfo if type == EV_ABS else codes)
+            for type, codes in raw.items()
+        }
+        info = self.devices[device.path] = DeviceInfo(
+            device, identity, capabilities, absinfo, _classify(capabilities, absinfo)
+        )
+        return info
+
+    def get(self, device: InputDevice) -> DeviceInfo:
+        info = self.devices.get(device.path)
+        if info is not None and self.seen.get(device.path) is device:
+            return info
+
+        identity = _identity(os.fstat(device.fd))
+        if info is None or info.identity != identity:
+            info = self._add(device, identity)
+
+        self.seen[device.path] = device
+        return info
+
+    def open(self, path: str) -> DeviceInfo | None:
+        """Return what is known about the device at path, reading it only if it
+        has not been seen before. Returns None if the node is gone or can't be
+        opened"""
+        try:
+            identity = _identity(os.stat(path))
+            info = self.devices.get(path)
+            if info is None or info.identity != identity:
+                device = self.opener(path)
+                try:
+                    info = self._add(device, identity)
+
+                finally:
+                    device.close()
+
+        except OSError:
+            return None
+
+        return info
+
+    def scan(self) -> list[DeviceInfo]:
+        """Return every input device, only reading the ones not seen before"""
+        found = {}
+        for path in list_devices(self.path):
+            info = self.open(path)
+            if info is not None:
+                found[path] = info
+
+        self.devices = found
+        return list(found.values())
+
+    def openEach(self, infos: list[DeviceInfo]) -> list[InputDevice]:
+        """Open a new InputDevice for each of infos, skipping any that are gone"""
+        devices = []
+        for info in infos:
+            try:
+                devices.append(self.opener(info.path))
+
+            except OSError:
+                continue
+
+        return devices
+
+    def remove(self, path: str) -> None:
+        self.devices.pop(path, None)
+        self.seen.pop(path, None)
+
+
+_registry = _Registry()
+
+
 class Input:
+    @classmethod
+    def deviceInfo(cls, device: InputDevice) -> DeviceInfo:
+        return _registry.get(device)
+
     @classmethod
     def devices(cls) -> list[InputDevice]:
-        return [InputDevice(path) for path in list_devices()]
+        return _registry.openEach(_registry.scan())
+
+    @classmethod
+    def _devicesOfType(cls, *types: str) -> list[InputDevice]:
+        return _registry.openEach([x for x in _registry.scan() if x.type in types])
 
     @classmethod
     def positionDevices(cls) -> list[InputDevice]:
-        return [d for d in cls.devices() if EV_ABS in d.capabilities()]
+        return _registry.openEach(
+            [x for x in _registry.scan() if EV_ABS in x.capabilities]
+        )
 
     @classmethod
     def keyDevices(cls) -> list[InputDevice]:
-        return [
-            d
-            for d in cls.devices()
-            if d not in cls.positionDevices() and EV_KEY in d.capabilities()
-        ]
+        return cls._devicesOfType("key")
 
     @classmethod
     def touchDevices(cls) -> list[InputDevice]:
-        return [d for d in cls.positionDevices() if d.absinfo(ABS_MT_TRACKING_ID).max]
+        return cls._devicesOfType("touch")
 
     @classmethod
     def wacomDevices(cls) -> list[InputDevice]:
-        return [
-            d
-            for d in cls.positionDevices()
-            if d not in cls.touchDevices() and BTN_STYLUS in d.capabilities()[EV_KEY]
-        ]
+        return cls._devicesOfType("wacom")
 
     @classmethod
     def deviceType(cls, device: InputDevice) -> str:
-        if device in cls.keyDevices():
-            return "key"
-
-        if device in cls.wacomDevices():
-            return "wacom"
-
-        if device in cls.touchDevices():
-            return "touch"
-
-        # TODO - add mouse and other pointer device support
-        return "unknown"
+        return _registry.get(device).type
 
     @classmethod
     def rawEvents(
-        cls, devices: list[InputDevice] = None, block: bool = False
+        cls,
+        devices: list[InputDevice] = None,
+        block: bool = False,
+        coalesce: bool = False,
+        keepSkipped: bool = False,
+    ) -> Iterator[tuple[InputDevice | None, list[InputEvent]]]:
+        """Yield each report from devices. See events() for coalesce and
+        keepSkipped"""
+        yield from cls._rawEvents(devices, block, coalesce, keepSkipped)
+
+    @classmethod
+    def _rawEvents(
+        cls,
+        devices: list[InputDevice] | None,
+        block: bool,
+        coalesce: bool,
+        keepSkipped: bool,
+        wakeup: int | None = None,
     ) -> Iterator[tuple[InputDevice | None, list[InputEvent]]]:
+        # Stops once wakeup, a file descriptor, becomes readable. This lets
+        # another thread end a blocking read
         selector = DefaultSelector()
-        for device in devices if devices is not None else cls.devices():
+        registered = {}
+        # Devices we open ourselves are closed again when we are done with them
+        owned = devices is None
+
+        def register(device: InputDevice) -> None:
+            if device.path in registered:
+                if owned:
+                    device.close()
+
+                return
+
+            registered[device.path] = device
             selector.register(device, EVENT_READ)
 
-        events = {}
-        while True:
-            try:
-                for key, mask in selector.select(timeout=100 if block else 0):
-                    device = key.fileobj
-                    for event in device.read():
-                        if device.path not in events.keys():
-                            events[device.path] = []
-
-                        events[device.path].append(event)
-                        if event.type != EV_SYN:
-                            continue
+        def unregister(device: InputDevice) -> None:
+            if registered.pop(device.path, None) is not None:
+                selector.unregister(device)
+                if owned:
+                    device.close()
+
+        # Only pick up new devices if we aren't filtering to a specific set.
+        # The watch is added before scanning so nothing added in between is
+        # missed, anything seen twice is only registered once
+        watcher = _watch() if devices is None else None
+        if watcher is not None:
+            selector.register(watcher, EVENT_READ)
+
+        for device in devices if devices is not None else cls.devices():
+            register(device)
+
+        if wakeup is not None:
+            selector.register(wakeup, EVENT_READ)
+
+        pending = {}
+        try:
+            while True:
+                try:
+                    for key, mask in selector.select(timeout=100 if block else 0):
+                        if key.fd == wakeup:
+                            return
+
+                        device = key.fileobj
+                        if device is watcher:
+                            added, removed = _hotplug(watcher, registered)
+                            for x in removed:
+                                unregister(x)
+
+                            for x in added:
+                                register(x)
 
-                        if event.code == SYN_DROPPED:
-                            events[device.path] = []
                             continue
 
-                        yield device, events[device.path]
-                        events[device.path] = []
+                        if coalesce:
+                            reports = _coalesce(_drain(device, pending), keepSkipped)
 
-                # TODO - don't require another input event to register when a keyboard has been added again
-                if devices is None:
-                    # Add any newly added devices if we aren't filtering to a specific set of events
-                    for device in cls.devices():
-                        if device not in [
-                            k.fileobj for k in selector.get_map().values()
-                        ]:
-                            selector.register(device, EVENT_READ)
+                        else:
+                            reports = _reports(device, pending)
 
-            except OSError as err:
-                if err.errno != ENODEV:
-                    raise
+                        for events in reports:
+                            yield device, events
 
-                selector.unregister(device)
+                except OSError as err:
+                    if err.errno != ENODEV:
+                        raise
+
+                    unregister(device)
+                    _registry.remove(device.path)
+
+                if not block:
+                    yield None, []
 
-            if not block:
-                yield None, []
+        finally:
+            for device in list(registered.values()):
+                unregister(device)
+
+            if watcher is not None:
+                watcher.close()
+
+            selector.close()
 
     @classmethod
     def rawPositionEvents(
@@ -455,58 +894,505 @@ class Input:
             yield d, e
 
     @classmethod
-    def _event(cls, device: InputDevice, state: dict) -> Event:
-        if state["type"] == "touch":
+    def _event(cls, device: InputDevice, state: _DeviceState) -> Event:
+        if state.type == "touch":
             return TouchEvent(device, state)
 
-        if state["type"] == "wacom":
+        if state.type == "wacom":
             return WacomEvent(device, state)
 
-        if state["type"] == "key":
+        if state.type == "key":
             return KeyEvent(device, state)
 
         return Event(device, state)
 
     @classmethod
-    def events(cls, block: bool = False) -> Event | None:
-        states = {}
-        for d, events in cls.rawEvents(block=block):
+    async def araw_events(
+        cls,
+        devices: list[InputDevice] = None,
+        coalesce: bool = False,
+        keepSkipped: bool = False,
+    ) -> AsyncIterator[tuple[InputDevice, list[InputEvent]]]:
+        """Like rawEvents, but waits for input on the running event loop instead
+        of polling"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        pending = {}
+        registered = {}
+        # Devices we open ourselves are closed again when we are done with them
+        owned = devices is None
+
+        def readable(device: InputDevice) -> None:
+            try:
+                if coalesce:
+                    reports = _coalesce(_drain(device, pending), keepSkipped)
+
+                else:
+                    reports = _reports(device, pending)
+
+                for events in reports:
+                    queue.put_nowait((device, events))
+
+            except OSError as err:
+                unregister(device)
+                _registry.remove(device.path)
+                if err.errno != ENODEV:
+                    queue.put_nowait((device, err))
+
+        def hotplugged() -> None:
+            added, removed = _hotplug(watcher, registered)
+            for device in removed:
+                unregister(device)
+
+            for device in added:
+                register(device)
+
+        def register(device: InputDevice) -> None:
+            if device.path in registered:
+                if owned:
+                    device.close()
+
+                return
+
+            registered[device.path] = device
+            loop.add_reader(device.fd, readable, device)
+
+        def unregister(device: InputDevice) -> None:
+            if registered.pop(device.path, None) is not None:
+                loop.remove_reader(device.fd)
+                if owned:
+                    device.close()
+
+        # Watch before scanning, see _rawEvents
+        watcher = _watch() if devices is None else None
+        if watcher is not None:
+            loop.add_reader(watcher.fd, hotplugged)
+
+        for device in devices if devices is not None else cls.devices():
+            register(device)
+
+        try:
+            while True:
+                device, events = await queue.get()
+                if isinstance(events, Exception):
+                    raise events
+
+                yield device, events
+
+        finally:
+            for device in list(registered.values()):
+                unregister(device)
+
+            if watcher is not None:
+                loop.remove_reader(watcher.fd)
+                watcher.close()
+
+    @classmethod
+    def events(
+        cls, block: bool = False, coalesce: bool = False, keepSkipped: bool = False
+    ) -> Event | None:
+        """Yield an event for each report. With coalesce, pen and touch motion
+        that is already outdated by the time it is read is collapsed into the
+        newest position, so a slow consumer doesn't fall further and further
+        behind. With keepSkipped the collapsed positions are kept, see
+        skippedScreenPos"""
+        states = _EventStates(cls)
+        for d, events in cls.rawEvents(
+            block=block, coalesce=coalesce, keepSkipped=keepSkipped
+        ):
             if d is None or not events:
                 if not block:
                     yield None
 
                 continue
 
-            if d.path not in states.keys():
-                states[d.path] = {
-                    "events": [],
-                    "type": cls.deviceType(d),
-                    "current": {},
-                    "previous": {},
-                    "slot": 0,
-                }
-
-            state = states[d.path]
-
-            for e in events:
-                if e.type == EV_SYN and e.code in (SYN_REPORT, SYN_MT_REPORT):
-                    yield cls._event(d, state)
-                    state["events"] = []
-                    state["previous"] = deepcopy(state["current"])
-                    continue
-
-                current = state["current"]
-                if e.type == EV_ABS and e.code == ABS_MT_SLOT:
-                    if state["events"]:
-                        yield cls._event(d, state)
-                        state["events"] = []
-                        state["previous"] = deepcopy(state["current"])
-
-                    state["slot"] = e.value
-
-                state["events"].append(e)
-                if state["slot"] not in current.keys():
-                    current[state["slot"]] = {}
-
-                current[state["slot"]][(e.type, e.code)] = e.value
+            yield from states.feed(d, events)
+
+    @classmethod
+    def record(
+        cls,
+        path: str,
+        devices: list[InputDevice] = None,
+        reports: int | None = None,
+    ) -> int:
+        """Write the raw reports from devices to path until the given number of
+        reports has been recorded or this is interrupted, returning how many
+        were written. Use replay() to play the recording back"""
+        from ._recording import Recorder
+
+        written = 0
+        with Recorder(path) as recorder:
+            for device, events in cls.rawEvents(devices, block=True):
+                recorder.write(cls.deviceInfo(device), events)
+                written += 1
+                if reports is not None and written >= reports:
+                    break
+
+        return written
+
+    @classmethod
+    def replay(cls, path: str, speed: float | None = 1.0) -> Iterator[Event]:
+        """Play back a recording made by record() through the same state
+        tracking as events(), without any devices. speed scales the time
+        between reports, None replays as fast as possible"""
+        from ._recording import replay
+
+        states = _EventStates(cls)
+        for device, info, events in replay(path, speed):
+            yield from states.feed(device, events, info)
+
+    @classmethod
+    async def aevents(
+        cls, coalesce: bool = False, keepSkipped: bool = False
+    ) -> AsyncIterator[Event]:
+        states = _EventStates(cls)
+        async for d, events in cls.araw_events(
+            coalesce=coalesce, keepSkipped=keepSkipped
+        ):
+            for event in states.feed(d, events):
+                yield event
+
+
+class _Coalesced(list):
+    """Report made by merging several reports. skipped holds, per slot, the
+    (code, value) pairs of the reports that were merged away, with a code of
+    -1 marking the end of each report. Events before the first ABS_MT_SLOT
+    are stored under None"""
+
+    __slots__ = ("skipped",)
+
+
+class _Resync(list):
+    """Report made from the device's current state after a SYN_DROPPED. Holds
+    every value, not only the ones that changed, see _delta()"""
+
+    __slots__ = ()
+
+
+def _motion_only(report: list[InputEvent]) -> bool:
+    if isinstance(report, _Resync):
+        return False
+
+    last = report[-1]
+    if last.type != EV_SYN or last.code != SYN_REPORT:
+        return False
+
+    for e in report[:-1]:
+        if e.type == EV_ABS:
+            if e.code == ABS_MT_TRACKING_ID:
+                return False
+
+        elif e.type != EV_MSC:
+            return False
+
+    return True
+
+
+def _merge(run: list[list[InputEvent]], keep: bool) -> list[InputEvent]:
+    groups: dict[int | None, dict[tuple[int, int], InputEvent]] = {}
+    skipped = {} if keep else None
+    slot = None
+    last = len(run) - 1
+    for i, report in enumerate(run):
+        touched = set()
+        for e in report[:-1]:
+            if e.type == EV_ABS and e.code == ABS_MT_SLOT:
+                slot = e.value
+                # Keep the slot that ends up active last
+                groups[slot] = groups.pop(slot, {})
                 continue
+
+            if slot not in groups:
+                groups[slot] = {}
+
+            groups[slot][(e.type, e.code)] = e
+            if keep and i != last and e.type == EV_ABS:
+                if slot not in skipped:
+                    skipped[slot] = array("i")
+
+                skipped[slot].extend((e.code, e.value))
+                touched.add(slot)
+
+        for x in touched:
+            skipped[x].extend((-1, 0))
+
+    end = run[-1][-1]
+    merged = _Coalesced()
+    for slot, values in groups.items():
+        if slot is not None:
+            merged.append(InputEvent(end.sec, end.usec, EV_ABS, ABS_MT_SLOT, slot))
+
+        merged.extend(values.values())
+
+    merged.append(end)
+    merged.skipped = skipped
+    return merged
+
+
+def _coalesce(
+    reports: list[list[InputEvent]], keep: bool = False
+) -> list[list[InputEvent]]:
+    """Collapse each run of reports that only move axes into a single report
+    with the newest value of each axis per slot. Reports that touch keys,
+    buttons or tracking IDs are passed through, so contacts and presses are
+    never lost"""
+    result = []
+    run = []
+    for report in reports:
+        if _motion_only(report):
+            run.append(report)
+            continue
+
+        if run:
+            result.append(run[0] if len(run) == 1 else _merge(run, keep))
+            run = []
+
+        result.append(report)
+
+    if run:
+        result.append(run[0] if len(run) == 1 else _merge(run, keep))
+
+    return result
+
+
+def _watch(path: str = INPUT_PATH) -> Inotify | None:
+    try:
+        return Inotify(path, IN_CREATE | IN_ATTRIB | IN_DELETE)
+
+    except OSError:
+        # Nothing to watch, so devices added later won't be picked up
+        return None
+
+
+def _hotplug(
+    watcher: Inotify,
+    registered: dict[str, InputDevice],
+    registry: _Registry = _registry,
+) -> tuple[list[InputDevice], list[InputDevice]]:
+    """Work out which devices have been added and removed from the pending
+    inotify events"""
+    added = []
+    removed = []
+    for mask, name in watcher.read():
+        if not name.startswith("event"):
+            continue
+
+        path = os.path.join(registry.path, name)
+        if mask & IN_DELETE:
+            registry.remove(path)
+            if path in registered:
+                removed.append(registered[path])
+
+            continue
+
+        if path in registered:
+            continue
+
+        # Nodes are often created before udev gives us access to them, so this
+        # can fail on IN_CREATE and then succeed on the following IN_ATTRIB
+        info = registry.open(path)
+        if info is not None and all(x.path != path for x in added):
+            added.extend(registry.openEach([info]))
+
+    return added, removed
+
+
+def _reports(
+    device: InputDevice,
+    pending: dict[str, list[InputEvent]],
+    events: Iterable[InputEvent] | None = None,
+) -> Iterator[list[InputEvent]]:
+    """Read the available events from device, or use the given ones, and split
+    them into reports that end with an EV_SYN, keeping any incomplete report
+    in pending"""
+    if device.path not in pending.keys():
+        pending[device.path] = []
+
+    for event in device.read() if events is None else events:
+        events = pending[device.path]
+        if events is None:
+            # Events up to the next SYN_REPORT after a SYN_DROPPED are only
+            # part of a report, so skip them and read the state instead
+            if event.type == EV_SYN and event.code == SYN_REPORT:
+                pending[device.path] = []
+                yield _resync(device, event)
+
+            continue
+
+        events.append(event)
+        if event.type != EV_SYN:
+            continue
+
+        if event.code == SYN_DROPPED:
+            pending[device.path] = None
+            continue
+
+        yield events
+        pending[device.path] = []
+
+
+def _drain(
+    device: InputDevice, pending: dict[str, list[InputEvent]]
+) -> list[list[InputEvent]]:
+    """Like _reports, but keeps reading until device has nothing left. A single
+    read returns at most READ_EVENTS events, which is only a few reports"""
+    reports = []
+    while True:
+        try:
+            events = list(device.read())
+
+        except BlockingIOError:
+            return reports
+
+        reports.extend(_reports(device, pending, events))
+        # A short read already emptied the kernel's buffer
+        if len(events) < READ_EVENTS:
+            return reports
+
+
+def _resync(device: InputDevice, end: InputEvent) -> _Resync:
+    """Read the current state of device into a report"""
+    info = _registry.get(device)
+    fd = device.fd
+    report = _Resync()
+
+    def add(type: int, code: int, value: int) -> None:
+        report.append(InputEvent(end.sec, end.usec, type, code, value))
+
+    if EV_KEY in info.capabilities:
+        pressed = _evdev.keys(fd)
+        for code in sorted(info.capabilities[EV_KEY]):
+            add(EV_KEY, code, pressed[code >> 3] >> (code & 7) & 1)
+
+    codes = sorted(info.absinfo)
+    for code in codes:
+        if code < ABS_MT_SLOT:
+            add(EV_ABS, code, _evdev.abs_value(fd, code))
+
+    if ABS_MT_SLOT in info.absinfo:
+        slots = info.absinfo[ABS_MT_SLOT].max + 1
+        values = {
+            code: _evdev.mt_values(fd, code, slots)
+            for code in codes
+            if code > ABS_MT_SLOT
+        }
+        for slot in range(slots):
+            add(EV_ABS, ABS_MT_SLOT, slot)
+            for code, value in values.items():
+                add(EV_ABS, code, value[slot])
+
+        add(EV_ABS, ABS_MT_SLOT, _evdev.abs_value(fd, ABS_MT_SLOT))
+
+    report.append(end)
+    return report
+
+
+def _delta(state: _DeviceState, report: _Resync) -> list[InputEvent]:
+    """Reduce a resync report to the values that differ from state, so only
+    what was missed is passed on"""
+    result = []
+    active = slot = state.slot
+    group = []
+    trackingId = None
+
+    def flush() -> None:
+        nonlocal active
+        if not group:
+            return
+
+        known = state.current.get(slot)
+        if trackingId == -1 and (
+            known is None or known.get((EV_ABS, ABS_MT_TRACKING_ID), -1) == -1
+        ):
+            # A slot without a contact, both before and after the drop
+            return
+
+        if slot != active:
+            result.append(slotEvent)
+            active = slot
+
+        result.extend(group)
+
+    slotEvent = None
+    for e in report[:-1]:
+        if e.type == EV_ABS and e.code == ABS_MT_SLOT:
+            flush()
+            slot = e.value
+            slotEvent = e
+            group = []
+            trackingId = None
+            continue
+
+        if e.type == EV_ABS and e.code == ABS_MT_TRACKING_ID:
+            trackingId = e.value
+
+        known = state.current.get(slot, _EMPTY)
+        if known.get((e.type, e.code), 0 if e.type == EV_KEY else None) != e.value:
+            group.append(e)
+
+    flush()
+    if slot != active:
+        result.append(slotEvent)
+
+    if result:
+        result.append(report[-1])
+
+    return result
+
+
+class _EventStates:
+    """Tracks the state of each device and turns reports into events"""
+
+    def __init__(self, input: type[Input]):
+        self.input = input
+        self.states: dict[str, _DeviceState] = {}
+
+    def feed(
+        self,
+        d: InputDevice,
+        events: list[InputEvent],
+        info: DeviceInfo | None = None,
+    ) -> Iterator[Event]:
+        state = self.states.get(d.path)
+        if state is None:
+            if info is None:
+                info = self.input.deviceInfo(d)
+
+            state = self.states[d.path] = _DeviceState(info)
+
+        if isinstance(events, _Resync):
+            events = _delta(state, events)
+
+        # Skipped values of a coalesced report, keyed by the slot they belong
+        # to, or None for those sent before any ABS_MT_SLOT
+        skipped = getattr(events, "skipped", None)
+        key = None
+        current = None
+        for e in events:
+            if e.type == EV_SYN and e.code in (SYN_REPORT, SYN_MT_REPORT):
+                if skipped:
+                    state.skipped = skipped.get(key)
+
+                yield self.input._event(d, state)
+                state.skipped = None
+                state.advance()
+                current = None
+                continue
+
+            if e.type == EV_ABS and e.code == ABS_MT_SLOT:
+                if state.events:
+                    if skipped:
+                        state.skipped = skipped.get(key)
+
+                    yield self.input._event(d, state)
+                    state.skipped = None
+                    state.advance()
+
+                state.slot = key = e.value
+                current = None
+
+            state.events.append(e)
+            if current is None:
+                current = state.writable()
+
+            current.set(e.type, e.code, e.value)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import os
+
+from threading import Event as ThreadEvent
+from threading import Thread
+
+from collections.abc import Iterator
+
+from evdev import InputDevice
+from evdev import InputEvent
+
+from ._input import DeviceInfo
+from ._input import Event
+from ._input import Input
+from ._input import _EventStates
+
+_Report = tuple[InputDevice, DeviceInfo, list[InputEvent]]
+
+
+class InputReader:
+    """Reads input devices on a worker thread into a ring of capacity
+    reports, so drawing doesn't hold up reading the kernel's event buffer.
+    Reports are turned into events on the thread that calls drain()"""
+
+    def __init__(
+        self,
+        devices: list[InputDevice] | None = None,
+        capacity: int = 1024,
+        coalesce: bool = False,
+        keepSkipped: bool = False,
+    ):
+        assert capacity > 0, "capacity must be positive"
+        self.devices = devices
+        self.capacity = capacity
+        self.coalesce = coalesce
+        self.keepSkipped = keepSkipped
+        # Only the worker advances _tail and only drain() advances _head, so
+        # neither side needs a lock to use the ring
+        self._ring: list[_Report | None] = [None] * capacity
+        self._head = 0
+        self._tail = 0
+        self._ready = ThreadEvent()
+        self._space = ThreadEvent()
+        self._states = _EventStates(Input)
+        self._wakeup = None
+        self._running = False
+        self._error = None
+        self._thread = None
+        # Number of times the worker had to wait for drain() to make room
+        self.overflows = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"InputReader(capacity={self.capacity}, pending={len(self)}, "
+            f"running={self._running})"
+        )
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._error = None
+        self._wakeup = os.pipe()
+        self._thread = Thread(target=self._run, name="libremarkable-input", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._running = False
+        os.write(self._wakeup[1], b"\0")
+        self._space.set()
+        self._thread.join()
+        self._thread = None
+        for fd in self._wakeup:
+            os.close(fd)
+
+        self._wakeup = None
+        self._raise()
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _put(self, item: _Report) -> bool:
+        if self._tail - self._head >= self.capacity:
+            self.overflows += 1
+            while self._tail - self._head >= self.capacity:
+                self._space.clear()
+                if not self._running:
+                    return False
+
+                if self._tail - self._head >= self.capacity:
+                    self._space.wait()
+
+        self._ring[self._tail % self.capacity] = item
+        self._tail += 1
+        self._ready.set()
+        return True
+
+    def _run(self) -> None:
+        try:
+            for device, events in Input._rawEvents(
+                self.devices, True, self.coalesce, self.keepSkipped, self._wakeup[0]
+            ):
+                if not self._put((device, Input.deviceInfo(device), events)):
+                    return
+
+        except OSError as e:
+            # Handed to the consumer, which raises it from drain() or stop()
+            self._error = e
+
+        finally:
+            self._running = False
+            self._ready.set()
+
+    def drain(
+        self, max: int | None = None, timeout: float | None = 0
+    ) -> Iterator[Event]:
+        """Yield the events for up to max of the reports read so far. If there
+        are none, wait up to timeout seconds for one, or forever if timeout is
+        None. Events stay valid after later ones are drained, so a batch can
+        be collected before it is handled"""
+        if self._head == self._tail and timeout != 0 and self._running:
+            self._ready.clear()
+            if self._head == self._tail and self._running:
+                self._ready.wait(timeout)
+
+        count = self._tail - self._head
+        if max is not None:
+            count = min(count, max)
+
+        if not count:
+            self._raise()
+
+        for _ in range(count):
+            index = self._head % self.capacity
+            device, info, events = self._ring[index]
+            self._ring[index] = None
+            self._head += 1
+            self._space.set()
+            yield from self._states.feed(device, events, info)
@@ -1,5 +1,42 @@
 from ctypes import CDLL
+from ctypes import c_char_p
+from ctypes import c_int
+from ctypes import c_long
+from ctypes import c_uint
+from ctypes import c_void_p
+from ctypes import POINTER
+from ctypes import Structure
 
 libc = CDLL("libc.so.6", use_errno=True)
 msgsnd = libc.msgsnd
 msgget = libc.msgget
+
+
+class timespec(Structure):
+    _fields_ = [
+        ("tv_sec", c_long),
+        ("tv_nsec", c_long),
+    ]
+
+
+# Before glibc 2.34 the semaphore functions live in libpthread
+libsem = libc if hasattr(libc, "sem_open") else CDLL("libpthread.so.0", use_errno=True)
+sem_open = libsem.sem_open
+sem_open.restype = c_void_p
+sem_open.argtypes = [c_char_p, c_int, c_uint, c_uint]
+sem_wait = libsem.sem_wait
+sem_wait.argtypes = [c_void_p]
+sem_trywait = libsem.sem_trywait
+sem_trywait.argtypes = [c_void_p]
+sem_timedwait = libsem.sem_timedwait
+sem_timedwait.argtypes = [c_void_p, POINTER(timespec)]
+sem_close = libsem.sem_close
+sem_close.argtypes = [c_void_p]
+sem_post = libsem.sem_post
+sem_post.argtypes = [c_void_p]
+sem_unlink = libsem.sem_unlink
+sem_unlink.argtypes = [c_char_p]
+inotify_init1 = libc.inotify_init1
+inotify_init1.argtypes = [c_int]
+inotify_add_watch = libc.inotify_add_watch
+inotify_add_watch.argtypes = [c_int, c_char_p, c_uint]
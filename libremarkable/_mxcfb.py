@@ -5,6 +5,12 @@ from ctypes import c_uint
 from ctypes import c_ulong
 from ctypes import Structure
 
+from threading import Thread
+
+from collections.abc import Sequence
+
+from dataclasses import dataclass
+
 from enum import auto
 from enum import IntEnum
 
@@ -287,37 +293,102 @@ class MXCFBException(Exception):
     pass
 
 
+@dataclass(frozen=True)
+class ScreenInfo:
+    """Snapshot of the variable and fixed screen info of the framebuffer"""
+
+    var: fb_var_screeninfo
+    fix: fb_fix_screeninfo
+
+    @property
+    def bits_per_pixel(self) -> int:
+        return self.var.bits_per_pixel
+
+    @property
+    def pixel_size(self) -> int:
+        return self.var.bits_per_pixel // 8
+
+    @property
+    def stride(self) -> int:
+        """Pixels from the start of one line to the next, including padding"""
+        if not self.fix.line_length:
+            return self.var.xres_virtual
+
+        return self.fix.line_length // self.pixel_size
+
+
+def _query(fd: int, request: int, info: Structure) -> Structure:
+    res = ioctl(fd, request, info)
+    if res < 0:
+        raise MXCFBException(res)
+
+    return info
+
+
+def _read_screen_info(fd: int) -> ScreenInfo:
+    return ScreenInfo(
+        _query(fd, FBIOGET_VSCREENINFO, fb_var_screeninfo()),
+        _query(fd, FBIOGET_FSCREENINFO, fb_fix_screeninfo()),
+    )
+
+
+_info: ScreenInfo | None = None
+
+
+def screen_info(fd: int | None = None) -> ScreenInfo:
+    """Cached screen info, read through fd when given so that mapping the
+    framebuffer does not open it a second time"""
+    global _info
+    if _info is not None:
+        return _info
+
+    from . import _framebuffer
+
+    if fd is None and _framebuffer._fb is not None:
+        fd = _framebuffer._fb["f"].fileno()
+
+    if fd is not None:
+        _info = _read_screen_info(fd)
+
+    else:
+        with open(FB_PATH, "rb") as f:
+            _info = _read_screen_info(f.fileno())
+
+    return _info
+
+
+def invalidate() -> None:
+    """Forget the cached screen info so it is read again on next use, and drop
+    the mapping of the framebuffer as it was laid out for the old geometry"""
+    global _info
+    _info = None
+
+    from . import _framebuffer
+
+    _framebuffer.FrameBuffer.release()
+
+
 def get_var_screeninfo() -> fb_var_screeninfo:
     with open(FB_PATH, "rb") as f:
-        info = fb_var_screeninfo()
-        res = ioctl(f.fileno(), FBIOGET_VSCREENINFO, info)
-        if res < 0:
-            raise MXCFBException(res)
-
-        return info
+        return _query(f.fileno(), FBIOGET_VSCREENINFO, fb_var_screeninfo())
 
 
 def get_fix_screeninfo() -> fb_fix_screeninfo:
     with open(FB_PATH, "rb") as f:
-        info = fb_fix_screeninfo()
-        res = ioctl(f.fileno(), FBIOGET_FSCREENINFO, info)
-        if res < 0:
-            raise MXCFBException(res)
+        return _query(f.fileno(), FBIOGET_FSCREENINFO, fb_fix_screeninfo())
 
-        return info
 
+def put_var_screeninfo(info: fb_var_screeninfo) -> None:
+    try:
+        with open(FB_PATH, "rb") as f:
+            _query(f.fileno(), FBIOPUT_VSCREENINFO, info)
 
-def getsize() -> int:
-    return get_fix_screeninfo().smem_len
+    finally:
+        invalidate()
 
 
-_width = None
-_height = None
-_v_width = None
-_v_height = None
-_x_offset = None
-_y_offset = None
-_pixel_width = None
+def getsize() -> int:
+    return screen_info().fix.smem_len
 
 
 def setup():
@@ -325,59 +396,35 @@ def setup():
 
 
 def width() -> int:
-    global _width
-    if _width is None:
-        _width = get_var_screeninfo().xres
-
-    return _width
+    return screen_info().var.xres
 
 
 def height() -> int:
-    global _height
-    if _height is None:
-        _height = get_var_screeninfo().yres
-
-    return _height
+    return screen_info().var.yres
 
 
 def virtual_width() -> int:
-    global _v_width
-    if _v_width is None:
-        _v_width = get_var_screeninfo().xres_virtual
-
-    return _v_width
+    return screen_info().var.xres_virtual
 
 
 def virtual_height() -> int:
-    global _v_height
-    if _v_height is None:
-        _v_height = get_var_screeninfo().yres_virtual
-
-    return _v_height
+    return screen_info().var.yres_virtual
 
 
 def x_offset() -> int:
-    global _x_offset
-    if _x_offset is None:
-        _x_offset = get_var_screeninfo().xoffset
-
-    return _x_offset
+    return screen_info().var.xoffset
 
 
 def y_offset() -> int:
-    global _y_offset
-    if _y_offset is None:
-        _y_offset = get_var_screeninfo().yoffset
+    return screen_info().var.yoffset
 
-    return _y_offset
 
+def stride() -> int:
+    return screen_info().stride
 
-def pixel_size() -> int:
-    global _pixel_width
-    if _pixel_width is None:
-        _pixel_width = int(get_var_screeninfo().bits_per_pixel / 8)
 
-    return _pixel_width
+def pixel_size() -> int:
+    return screen_info().pixel_size
 
 
 def _fileno():
@@ -392,11 +439,83 @@ def update(data: mxcfb_update_data) -> None:
         raise MXCFBException(res)
 
 
+def update_many(updates: Sequence[mxcfb_update_data], nowait: bool = False) -> int:
+    # The ioctl never blocks on a full queue, so nowait has nothing to do
+    for data in updates:
+        update(data)
+
+    return len(updates)
+
+
 def path() -> str:
     return "/dev/fb0"
 
 
-def wait(marker: int) -> None:
+# Threads waiting on markers that have been polled, with any error they hit
+_polls: dict[int, tuple[Thread, list[Exception]]] = {}
+MAX_POLLS = 64
+# Newest marker seen to complete. Updates complete in order, so every marker
+# before it has as well
+_completed = 0
+
+
+def _forget(marker: int) -> None:
+    """Drop the threads for markers before marker that have finished, as no
+    one needs to be told about them any more"""
+    global _completed
+    for key in [k for k, (t, _) in _polls.items() if k < marker and not t.is_alive()]:
+        if not _polls.pop(key)[1]:
+            _completed = max(_completed, key)
+
+    if len(_polls) > MAX_POLLS:
+        # Only callers that poll many markers without waiting get here, the
+        # threads still finish but their results are no longer kept
+        for key in sorted(_polls)[: len(_polls) - MAX_POLLS]:
+            del _polls[key]
+
+
+def poll(marker: int) -> bool:
+    """Check if the update for marker has completed without blocking. The
+    driver can only block until an update completes, so the first poll for a
+    marker starts a thread that waits for it"""
+    global _completed
+    _forget(marker)
+    if marker <= _completed:
+        return True
+
+    entry = _polls.get(marker)
+    if entry is None:
+        errors = []
+
+        def waiter() -> None:
+            try:
+                wait(marker)
+
+            except (OSError, MXCFBException) as e:
+                errors.append(e)
+
+        thread = Thread(target=waiter, name="libremarkable-mxcfb-poll", daemon=True)
+        thread.start()
+        entry = _polls[marker] = (thread, errors)
+
+    thread, errors = entry
+    if thread.is_alive():
+        return False
+
+    del _polls[marker]
+    if errors:
+        raise errors[0]
+
+    _completed = marker
+    # Everything before marker is done as well
+    for key in [k for k in _polls if k < marker]:
+        del _polls[key]
+
+    return True
+
+
+def wait(marker: int, timeout: float | None = None) -> None:
+    # The driver applies its own timeout and fails the ioctl once it expires
     data = mxcfb_update_marker_data()
     data.update_marker = marker
     res = ioctl(_fileno(), MXCFB_WAIT_FOR_UPDATE_COMPLETE, data)
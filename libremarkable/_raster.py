@@ -0,0 +1,203 @@
+import math
+
+from array import array
+
+from collections.abc import Iterable
+
+from itertools import pairwise
+
+from bresenham import bresenham
+
+from .geometry import Point
+from .geometry import Rect
+
+CAPS = ("butt", "round", "square")
+JOINS = ("round", "bevel")
+
+# Spans are stored per row as a list of inclusive (x0, x1) pairs
+Spans = dict[int, list[tuple[int, int]]]
+
+
+class _Rasterizer:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.spans: Spans = {}
+
+    def span(self, y: int, x0: int, x1: int) -> None:
+        if not 0 <= y < self.height:
+            return
+
+        x0 = max(x0, 0)
+        x1 = min(x1, self.width - 1)
+        if x0 > x1:
+            return
+
+        if y not in self.spans:
+            self.spans[y] = []
+
+        self.spans[y].append((x0, x1))
+
+    def rows(self, top: float, bottom: float) -> range:
+        # Rows whose pixel centers fall between top and bottom
+        return range(
+            max(math.ceil(top - 0.5), 0),
+            min(math.floor(bottom - 0.5), self.height - 1) + 1,
+        )
+
+    def circle(self, cx: float, cy: float, radius: float) -> None:
+        for y in self.rows(cy - radius, cy + radius):
+            dy = y + 0.5 - cy
+            half = math.sqrt(max(radius * radius - dy * dy, 0))
+            self.span(y, math.ceil(cx - half - 0.5), math.floor(cx + half - 0.5))
+
+    def polygon(self, *points: tuple[float, float]) -> None:
+        """Fill a convex polygon"""
+        ys = [y for _, y in points]
+        edges = list(pairwise(points + points[:1]))
+        for y in self.rows(min(ys), max(ys)):
+            yc = y + 0.5
+            xs = [
+                x0 + (yc - y0) * (x1 - x0) / (y1 - y0)
+                for (x0, y0), (x1, y1) in edges
+                if min(y0, y1) <= yc <= max(y0, y1) and y0 != y1
+            ]
+            if xs:
+                self.span(y, math.ceil(min(xs) - 0.5), math.floor(max(xs) - 0.5))
+
+    def line(self, x1: int, y1: int, x2: int, y2: int) -> None:
+        for x, y in bresenham(x1, y1, x2, y2):
+            self.span(y, x, x)
+
+    def merged(self) -> Spans:
+        spans = {}
+        for y, row in self.spans.items():
+            row.sort()
+            merged = [row[0]]
+            for x0, x1 in row[1:]:
+                left, right = merged[-1]
+                if x0 <= right + 1:
+                    merged[-1] = (left, max(right, x1))
+
+                else:
+                    merged.append((x0, x1))
+
+            spans[y] = merged
+
+        return spans
+
+
+def polyline_spans(
+    points: Iterable[tuple[int, int] | Point],
+    width: int,
+    height: int,
+    lineWidth: int = 1,
+    cap: str = "round",
+    join: str = "round",
+) -> Spans:
+    """Rasterize a polyline into horizontal spans clipped to width x height"""
+    assert cap in CAPS, f"cap must be one of {CAPS}"
+    assert join in JOINS, f"join must be one of {JOINS}"
+    points = [tuple(x) for x in points]
+    raster = _Rasterizer(width, height)
+    if not points:
+        return {}
+
+    if lineWidth <= 1:
+        for (x1, y1), (x2, y2) in pairwise(points):
+            raster.line(int(x1), int(y1), int(x2), int(y2))
+
+        if len(points) == 1:
+            x, y = points[0]
+            raster.span(int(y), int(x), int(x))
+
+        return raster.merged()
+
+    radius = lineWidth / 2
+    # Work from pixel centers
+    centers = [(x + 0.5, y + 0.5) for x, y in points]
+    centers = [p for p, q in zip(centers, [None] + centers) if p != q]
+    if len(centers) == 1:
+        x, y = centers[0]
+        if cap == "round":
+            raster.circle(x, y, radius)
+
+        elif cap == "square":
+            raster.polygon(
+                (x - radius, y - radius),
+                (x + radius, y - radius),
+                (x + radius, y + radius),
+                (x - radius, y + radius),
+            )
+
+        return raster.merged()
+
+    normals = []
+    for (x1, y1), (x2, y2) in pairwise(centers):
+        length = math.hypot(x2 - x1, y2 - y1)
+        normals.append(((y1 - y2) / length * radius, (x2 - x1) / length * radius))
+
+    last = len(normals) - 1
+    for i, ((x1, y1), (x2, y2)) in enumerate(pairwise(centers)):
+        nx, ny = normals[i]
+        if cap == "square":
+            # Extend the first and last segments by half the line width
+            dx, dy = ny, -nx
+            if i == 0:
+                x1, y1 = x1 - dx, y1 - dy
+
+            if i == last:
+                x2, y2 = x2 + dx, y2 + dy
+
+        raster.polygon(
+            (x1 + nx, y1 + ny),
+            (x2 + nx, y2 + ny),
+            (x2 - nx, y2 - ny),
+            (x1 - nx, y1 - ny),
+        )
+
+    for i, (x, y) in enumerate(centers[1:-1]):
+        if join == "round":
+            raster.circle(x, y, radius)
+            continue
+
+        (ax, ay), (bx, by) = normals[i], normals[i + 1]
+        raster.polygon((x, y), (x + ax, y + ay), (x + bx, y + by))
+        raster.polygon((x, y), (x - ax, y - ay), (x - bx, y - by))
+
+    if cap == "round":
+        raster.circle(*centers[0], radius)
+        raster.circle(*centers[-1], radius)
+
+    return raster.merged()
+
+
+def spans_rect(spans: Spans) -> Rect | None:
+    """Bounding rectangle of the pixels covered by spans"""
+    if not spans:
+        return None
+
+    return Rect(
+        min(row[0][0] for row in spans.values()),
+        min(spans.keys()),
+        max(row[-1][1] for row in spans.values()) + 1,
+        max(spans.keys()) + 1,
+    )
+
+
+def spans_pixels(spans: Spans) -> int:
+    return sum(x1 - x0 + 1 for row in spans.values() for x0, x1 in row)
+
+
+def fill_spans(
+    dst: memoryview, offset: int, stride: int, spans: Spans, color: int
+) -> None:
+    if not spans:
+        return
+
+    longest = max(x1 - x0 + 1 for row in spans.values() for x0, x1 in row)
+    pixels = memoryview(array(dst.format, [color]) * longest)
+    for y, row in spans.items():
+        base = offset + y * stride
+        for x0, x1 in row:
+            dst[base + x0 : base + x1 + 1] = pixels[: x1 - x0 + 1]
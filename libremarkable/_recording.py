@@ -0,0 +1,224 @@
+import time
+import struct
+
+from collections.abc import Iterator
+
+from contextlib import ExitStack
+
+from typing import BinaryIO
+
+from evdev import AbsInfo
+from evdev import InputEvent
+
+from evdev.ecodes import EV_ABS
+
+from ._input import DeviceInfo
+from ._input import _Resync
+
+MAGIC = b"LRMINPUT"
+VERSION = 2
+# Version 1 has no resync records, so it reads the same way
+SUPPORTED_VERSIONS = (1, 2)
+
+_VERSION = struct.Struct("<H")
+_TAG = struct.Struct("<cH")
+_COUNT = struct.Struct("<H")
+_ABSINFO = struct.Struct("<H6i")
+_EVENT = struct.Struct("<qiHHi")
+_EVENTS = struct.Struct("<I")
+
+TAG_DEVICE = b"D"
+TAG_REPORT = b"R"
+# A report read from the device's state after a SYN_DROPPED, see _resync()
+TAG_RESYNC = b"S"
+
+
+class RecordedDevice:
+    """Stands in for an InputDevice when replaying a recording"""
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        capabilities: dict[int, list[int]],
+        absinfo: dict[int, AbsInfo],
+    ):
+        self.path = path
+        self.name = name
+        self._capabilities = capabilities
+        self._absinfo = absinfo
+        self.fd = -1
+
+    def __repr__(self) -> str:
+        return f"RecordedDevice({self.path!r}, name={self.name!r})"
+
+    def capabilities(self, verbose: bool = False, absinfo: bool = True) -> dict:
+        capabilities = dict(self._capabilities)
+        if absinfo and self._absinfo:
+            capabilities[EV_ABS] = list(self._absinfo.items())
+
+        return capabilities
+
+    def absinfo(self, code: int) -> AbsInfo:
+        return self._absinfo[code]
+
+
+def _write_string(f: BinaryIO, value: str) -> None:
+    data = value.encode("utf-8")
+    f.write(_COUNT.pack(len(data)))
+    f.write(data)
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError("Recording is truncated")
+
+    return data
+
+
+def _read_string(f: BinaryIO) -> str:
+    (length,) = _COUNT.unpack(_read_exact(f, _COUNT.size))
+    return _read_exact(f, length).decode("utf-8")
+
+
+class Recorder:
+    """Writes reports from input devices, along with what is needed to
+    classify each device, to a binary file"""
+
+    def __init__(self, path: str):
+        # The file is closed straight away if writing the header fails,
+        # otherwise it stays open until close()
+        with ExitStack() as stack:
+            self.f = stack.enter_context(open(path, "wb"))
+            self.f.write(MAGIC)
+            self.f.write(_VERSION.pack(VERSION))
+            self._files = stack.pop_all()
+
+        self.ids: dict[str, int] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _device(self, info: DeviceInfo) -> int:
+        id = self.ids.get(info.path)
+        if id is not None:
+            return id
+
+        id = self.ids[info.path] = len(self.ids)
+        f = self.f
+        f.write(_TAG.pack(TAG_DEVICE, id))
+        _write_string(f, info.path)
+        _write_string(f, getattr(info.device, "name", ""))
+        _write_string(f, info.type)
+        capabilities = {
+            type: codes for type, codes in info.capabilities.items() if type != EV_ABS
+        }
+        f.write(_COUNT.pack(len(capabilities)))
+        for type, codes in capabilities.items():
+            f.write(_COUNT.pack(type))
+            f.write(_COUNT.pack(len(codes)))
+            f.write(struct.pack(f"<{len(codes)}H", *sorted(codes)))
+
+        f.write(_COUNT.pack(len(info.absinfo)))
+        for code, absinfo in info.absinfo.items():
+            f.write(_ABSINFO.pack(code, *absinfo))
+
+        return id
+
+    def write(self, info: DeviceInfo, events: list[InputEvent]) -> None:
+        f = self.f
+        tag = TAG_RESYNC if isinstance(events, _Resync) else TAG_REPORT
+        f.write(_TAG.pack(tag, self._device(info)))
+        f.write(_EVENTS.pack(len(events)))
+        for e in events:
+            f.write(_EVENT.pack(e.sec, e.usec, e.type, e.code, e.value))
+
+    def close(self) -> None:
+        self._files.close()
+
+
+def read(path: str) -> Iterator[tuple[RecordedDevice, DeviceInfo, list[InputEvent]]]:
+    """Read the reports from a recording along with the device they came from"""
+    infos: dict[int, DeviceInfo] = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an input recording")
+
+        (version,) = _VERSION.unpack(_read_exact(f, _VERSION.size))
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported recording version {version}")
+
+        while True:
+            header = f.read(_TAG.size)
+            if not header:
+                return
+
+            if len(header) != _TAG.size:
+                raise EOFError("Recording is truncated")
+
+            tag, id = _TAG.unpack(header)
+            if tag == TAG_DEVICE:
+                infos[id] = _read_device(f)
+                continue
+
+            if tag not in (TAG_REPORT, TAG_RESYNC):
+                raise ValueError(f"Unknown record {tag!r} in recording")
+
+            info = infos[id]
+            (count,) = _EVENTS.unpack(_read_exact(f, _EVENTS.size))
+            data = _read_exact(f, _EVENT.size * count)
+            events = [InputEvent(*x) for x in _EVENT.iter_unpack(data)]
+            if tag == TAG_RESYNC:
+                events = _Resync(events)
+
+            yield info.device, info, events
+
+
+def _read_device(f: BinaryIO) -> DeviceInfo:
+    path = _read_string(f)
+    name = _read_string(f)
+    type = _read_string(f)
+    capabilities = {}
+    (count,) = _COUNT.unpack(_read_exact(f, _COUNT.size))
+    for _ in range(count):
+        (evtype,) = _COUNT.unpack(_read_exact(f, _COUNT.size))
+        (length,) = _COUNT.unpack(_read_exact(f, _COUNT.size))
+        capabilities[evtype] = list(
+            struct.unpack(f"<{length}H", _read_exact(f, length * 2))
+        )
+
+    absinfo = {}
+    (count,) = _COUNT.unpack(_read_exact(f, _COUNT.size))
+    for _ in range(count):
+        code, *values = _ABSINFO.unpack(_read_exact(f, _ABSINFO.size))
+        absinfo[code] = AbsInfo(*values)
+
+    device = RecordedDevice(path, name, capabilities, absinfo)
+    frozen = {evtype: frozenset(codes) for evtype, codes in capabilities.items()}
+    if absinfo:
+        frozen[EV_ABS] = frozenset(absinfo)
+
+    return DeviceInfo(device, (0, 0), frozen, absinfo, type)
+
+
+def replay(
+    path: str, speed: float | None = 1.0
+) -> Iterator[tuple[RecordedDevice, DeviceInfo, list[InputEvent]]]:
+    """Read a recording, waiting between reports to match how they were
+    recorded. speed scales the delays, None replays as fast as possible"""
+    start = None
+    for device, info, events in read(path):
+        if speed and events:
+            timestamp = events[-1].timestamp()
+            if start is None:
+                start = (time.monotonic(), timestamp)
+
+            delay = start[0] + (timestamp - start[1]) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        yield device, info, events
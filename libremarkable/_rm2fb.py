@@ -1,5 +1,6 @@
 import os
 import time
+import errno
 
 from ctypes import byref
 from ctypes import c_char
@@ -12,6 +13,11 @@ from ctypes import sizeof
 from ctypes import Structure
 from ctypes import Union
 
+from threading import Condition
+from threading import Lock
+
+from collections.abc import Sequence
+
 from enum import auto
 from enum import IntEnum
 
@@ -20,6 +26,11 @@ from typing import overload
 from ._mxcfb import mxcfb_update_data
 from ._libc import msgsnd
 from ._libc import msgget
+from ._libc import sem_open
+from ._libc import sem_wait
+from ._libc import sem_trywait
+from ._libc import sem_timedwait
+from ._libc import timespec
 
 DEBUG_TIMING = "DEBUG_TIMING" in os.environ
 
@@ -75,8 +86,16 @@ class RM2FBException(Exception):
 
 
 IPC_CREAT = 512
+IPC_NOWAIT = 2048
 MSG_Q_ID = 0x2257C
 msqid = -1
+UPDATE_SIZE = sizeof(mxcfb_update_data)
+
+# Messages are copied by msgsnd, so one preallocated message is reused
+_lock = Lock()
+_msg = swtfb_update()
+_msg_ref = byref(_msg)
+_mdata = _msg.mdata
 
 
 def setup():
@@ -104,47 +123,70 @@ def send(data: mxcfb_update_data) -> None:
 
 def send(data):
     global msqid
-    msg = swtfb_update()
-    if DEBUG_TIMING:
-        msg.mdata.ms = time.time_ns() // 1_000_000
-
-    if isinstance(data, wait_sem_data):
-        msg.mtype = MSG_TYPE.WAIT
-        msg.mdata.wait_update = data
-        res = msgsnd(msqid, byref(msg), sizeof(msg.mdata.wait_update), 0)
-        if res < 0:
-            err = os.strerror(get_errno())
-            raise RM2FBException(f"Error sending wait update: {err} {res}")
+    with _lock:
+        msg = _msg
+        if DEBUG_TIMING:
+            msg.mdata.ms = time.time_ns() // 1_000_000
+
+        if isinstance(data, wait_sem_data):
+            msg.mtype = MSG_TYPE.WAIT
+            msg.mdata.wait_update = data
+            res = msgsnd(msqid, _msg_ref, sizeof(wait_sem_data), 0)
+            if res < 0:
+                err = os.strerror(get_errno())
+                raise RM2FBException(f"Error sending wait update: {err} {res}")
+
+        elif isinstance(data, xochitl_data):
+            msg.mtype = MSG_TYPE.XO
+            msg.mdata.xochitl_update = data
+            res = msgsnd(msqid, _msg_ref, sizeof(xochitl_data), 0)
+            if res < 0:
+                err = os.strerror(get_errno())
+                raise RM2FBException(f"Error sending xochitl update: {err} {res}")
+
+        elif isinstance(data, mxcfb_update_data):
+            msg.mtype = MSG_TYPE.UPDATE
+            msg.mdata.update = data
+            if DEBUG_TIMING:
+                print(
+                    f"MSG Q SEND {msg.mdata.ms} {data.update_region.left},{data.update_region.top} "
+                    f"{data.update_region.width}x{data.update_region.height} "
+                    f"{data.waveform_mode} {data.update_mode} {data.update_marker} "
+                    f"{data.temp}"
+                )
+
+            res = msgsnd(msqid, _msg_ref, UPDATE_SIZE, 0)
+            if res < 0:
+                err = os.strerror(get_errno())
+                raise RM2FBException(f"Error sendng mxcfb update: {err} {res}")
+
+        else:
+            raise NotImplementedError()
 
-    elif isinstance(data, xochitl_data):
-        msg.mtype = MSG_TYPE.XO
-        msg.mdata.xochitl_update = data
-        res = msgsnd(msqid, byref(msg), sizeof(msg.mdata.xochitl_update), 0)
-        if res < 0:
-            err = os.strerror(get_errno())
-            raise RM2FBException(f"Error sending xochitl update: {err} {res}")
 
-    elif isinstance(data, mxcfb_update_data):
-        msg.mtype = MSG_TYPE.UPDATE
-        msg.mdata.update = data
-        if DEBUG_TIMING:
-            print(
-                f"MSG Q SEND {msg.mdata.ms} {data.update_region.left},{data.update_region.top} "
-                f"{data.update_region.width}x{data.update_region.height} "
-                f"{data.waveform_mode} {data.update_mode} {data.update_marker} "
-                f"{data.temp}"
-            )
-
-        res = msgsnd(msqid, byref(msg), sizeof(msg.mdata.update), 0)
-        if res < 0:
-            err = os.strerror(get_errno())
-            raise RM2FBException(f"Error sendng mxcfb update: {err} {res}")
+update = send
 
-    else:
-        raise NotImplementedError()
 
+def update_many(updates: Sequence[mxcfb_update_data], nowait: bool = False) -> int:
+    """Send a burst of updates, returning how many were queued. With nowait
+    sending stops as soon as the message queue is full instead of blocking"""
+    flags = IPC_NOWAIT if nowait else 0
+    with _lock:
+        _msg.mtype = MSG_TYPE.UPDATE
+        for i, data in enumerate(updates):
+            if DEBUG_TIMING:
+                _mdata.ms = time.time_ns() // 1_000_000
 
-update = send
+            _mdata.update = data
+            if msgsnd(msqid, _msg_ref, UPDATE_SIZE, flags) < 0:
+                code = get_errno()
+                if nowait and code == errno.EAGAIN:
+                    return i
+
+                err = os.strerror(code)
+                raise RM2FBException(f"Error sending mxcfb update: {err}")
+
+    return len(updates)
 
 
 def width() -> int:
@@ -157,6 +199,7 @@ def height() -> int:
 
 virtual_width = width
 virtual_height = height
+stride = width
 
 
 def x_offset() -> int:
@@ -178,7 +221,149 @@ def getsize() -> int:
     return os.path.getsize(path())
 
 
-def wait(marker: int) -> None:
+_semaphore = None
+# The server posts the semaphore once for each WAIT request, after every update
+# sent before it has been displayed. Requests are answered in order, so the
+# n-th post answers the n-th request
+_sent = 0
+_posted = 0
+# Number of the request that covers each marker being waited on
+_requests: dict[int, int] = {}
+MAX_REQUESTS = 256
+# Guards the counters above. Only one thread blocks on the semaphore at a time,
+# any others wait here and are woken after each post it takes, since that post
+# may be the one they need
+_state = Condition()
+_consuming = False
+
+
+def _sem_name() -> bytes:
+    return f"/rm2fb.wait.{os.getpid()}".encode("utf-8")
+
+
+def _sem():
+    global _semaphore
+    if _semaphore is None:
+        sem = sem_open(_sem_name(), os.O_CREAT, 0o644, 0)
+        if not sem:
+            err = os.strerror(get_errno())
+            raise RM2FBException(f"Failed to open wait semaphore: {err}")
+
+        # An earlier process with the same pid may have left posts behind.
+        # Nothing has been requested yet, so none of them are ours
+        while sem_trywait(sem) == 0:
+            pass
+
+        _semaphore = sem
+
+    return _semaphore
+
+
+def _request(marker: int) -> None:
+    """Ask the server to post the semaphore once the update for marker has
+    been displayed, unless that has already been asked for. Called with
+    _state held"""
+    global _sent
+    if marker in _requests:
+        return
+
+    if len(_requests) >= MAX_REQUESTS:
+        # Forget markers that are done but were never checked again
+        for key in [k for k, v in _requests.items() if v <= _posted]:
+            del _requests[key]
+
+    # Open the semaphore before the server can post it
+    _sem()
     data = wait_sem_data()
-    data.sem_name = f"/rm2fb.wait.{os.getpid()}".encode("utf-8")
+    data.sem_name = _sem_name()
     send(data)
+    _sent += 1
+    _requests[marker] = _sent
+
+
+def _done(marker: int) -> bool:
+    if _requests[marker] > _posted:
+        return False
+
+    del _requests[marker]
+    return True
+
+
+def poll(marker: int) -> bool:
+    """Check if the update for marker has completed without blocking"""
+    global _posted
+    with _state:
+        _request(marker)
+        sem = _sem()
+        while not _done(marker):
+            if _consuming:
+                # A waiter is taking the posts and will count them
+                return False
+
+            if sem_trywait(sem) == 0:
+                _posted += 1
+                _state.notify_all()
+                continue
+
+            if get_errno() != errno.EAGAIN:
+                err = os.strerror(get_errno())
+                raise RM2FBException(f"Failed to poll wait semaphore: {err}")
+
+            return False
+
+        return True
+
+
+def wait(marker: int, timeout: float | None = None) -> None:
+    """Block until the update for marker has completed, raising TimeoutError
+    if that takes longer than timeout seconds"""
+    global _posted
+    global _consuming
+    deadline = None if timeout is None else time.time() + timeout
+    with _state:
+        _request(marker)
+        sem = _sem()
+
+    while True:
+        with _state:
+            while not _done(marker):
+                if not _consuming:
+                    break
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Timed out waiting for update {marker}")
+
+                _state.wait(remaining)
+
+            else:
+                return
+
+            _consuming = True
+
+        res = -1
+        try:
+            if deadline is None:
+                res = sem_wait(sem)
+
+            else:
+                ts = timespec(int(deadline), int(deadline % 1 * 1_000_000_000))
+                res = sem_timedwait(sem, byref(ts))
+
+            code = 0 if res == 0 else get_errno()
+
+        finally:
+            with _state:
+                _consuming = False
+                if res == 0:
+                    _posted += 1
+
+                _state.notify_all()
+
+        if code in (0, errno.EINTR):
+            continue
+
+        if code == errno.ETIMEDOUT:
+            raise TimeoutError(f"Timed out waiting for update {marker}")
+
+        raise RM2FBException(f"Failed to wait on semaphore: {os.strerror(code)}")
@@ -0,0 +1,247 @@
+import os
+import time
+import atexit
+import tempfile
+
+from ctypes import c_ushort
+from ctypes import sizeof
+
+from collections import deque
+from collections.abc import Sequence
+
+from dataclasses import dataclass
+
+from PIL import Image
+
+from ._mxcfb import mxcfb_update_data
+
+ENV = "LIBREMARKABLE_SIMFB"
+ENV_PATH = "LIBREMARKABLE_SIMFB_PATH"
+ENV_SIZE = "LIBREMARKABLE_SIMFB_SIZE"
+DEFAULT_SIZE = (1404, 1872)
+# Only the most recent calls are kept, so long runs don't grow without bound
+HISTORY_SIZE = 4096
+
+
+@dataclass
+class SimulatedCall:
+    time: float
+    kind: str
+    marker: int
+    left: int = 0
+    top: int = 0
+    width: int = 0
+    height: int = 0
+    waveform: int = 0
+    update_mode: int = 0
+
+
+def _default_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"libremarkable.simfb.{os.getpid()}")
+
+
+def _enabled_from_env() -> bool:
+    return os.environ.get(ENV, "").lower() not in ("", "0", "false", "no", "off")
+
+
+def _size_from_env() -> tuple[int, int]:
+    if ENV_SIZE not in os.environ:
+        return DEFAULT_SIZE
+
+    width, height = os.environ[ENV_SIZE].lower().split("x")
+    return int(width), int(height)
+
+
+_enabled = _enabled_from_env()
+_path = os.environ.get(ENV_PATH) or _default_path()
+_width, _height = _size_from_env()
+_v_width = _width
+_v_height = _height
+_stride = _width
+_x_offset = 0
+_y_offset = 0
+_dump_dir = None
+_history: deque[SimulatedCall] = deque(maxlen=HISTORY_SIZE)
+_updates = 0
+# Framebuffer files at the default path that setup() created, removed at exit
+_created: set[str] = set()
+
+
+def _remove_created() -> None:
+    for path in _created:
+        try:
+            os.unlink(path)
+
+        except FileNotFoundError:
+            pass
+
+    _created.clear()
+
+
+atexit.register(_remove_created)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def configure(
+    path: str | None = None,
+    width: int = DEFAULT_SIZE[0],
+    height: int = DEFAULT_SIZE[1],
+    virtual_width: int | None = None,
+    virtual_height: int | None = None,
+    x_offset: int = 0,
+    y_offset: int = 0,
+    dump_dir: str | None = None,
+    stride: int | None = None,
+) -> None:
+    global _enabled
+    global _path
+    global _width
+    global _height
+    global _v_width
+    global _v_height
+    global _x_offset
+    global _y_offset
+    global _dump_dir
+    global _stride
+    _v_width = virtual_width if virtual_width is not None else width + x_offset
+    _v_height = virtual_height if virtual_height is not None else height + y_offset
+    assert width + x_offset <= _v_width, "width does not fit in virtual_width"
+    assert height + y_offset <= _v_height, "height does not fit in virtual_height"
+    _stride = stride if stride is not None else _v_width
+    assert _v_width <= _stride, "virtual_width does not fit in stride"
+    _enabled = True
+    _path = path or _default_path()
+    _width = width
+    _height = height
+    _x_offset = x_offset
+    _y_offset = y_offset
+    _dump_dir = dump_dir
+    clear_history()
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def setup():
+    size = getsize() if os.path.exists(_path) else 0
+    expected = _stride * _v_height * pixel_size()
+    if size != expected:
+        if not os.path.exists(_path) and _path == _default_path():
+            _created.add(_path)
+
+        with open(_path, "wb") as f:
+            f.truncate(expected)
+
+
+def path() -> str:
+    return _path
+
+
+def getsize() -> int:
+    return os.path.getsize(_path)
+
+
+def width() -> int:
+    return _width
+
+
+def height() -> int:
+    return _height
+
+
+def virtual_width() -> int:
+    return _v_width
+
+
+def virtual_height() -> int:
+    return _v_height
+
+
+def stride() -> int:
+    return _stride
+
+
+def x_offset() -> int:
+    return _x_offset
+
+
+def y_offset() -> int:
+    return _y_offset
+
+
+def pixel_size() -> int:
+    return sizeof(c_ushort)
+
+
+def update(data: mxcfb_update_data) -> None:
+    global _updates
+    _updates += 1
+    region = data.update_region
+    _history.append(
+        SimulatedCall(
+            time.monotonic(),
+            "update",
+            data.update_marker,
+            region.left,
+            region.top,
+            region.width,
+            region.height,
+            data.waveform_mode,
+            data.update_mode,
+        )
+    )
+    if _dump_dir is not None:
+        dump(os.path.join(_dump_dir, f"update-{_updates:06d}.png"))
+
+
+def update_many(updates: Sequence[mxcfb_update_data], nowait: bool = False) -> int:
+    for data in updates:
+        update(data)
+
+    return len(updates)
+
+
+def poll(marker: int) -> bool:
+    _history.append(SimulatedCall(time.monotonic(), "poll", marker))
+    return True
+
+
+def wait(marker: int, timeout: float | None = None) -> None:
+    _history.append(SimulatedCall(time.monotonic(), "wait", marker))
+
+
+def history() -> list[SimulatedCall]:
+    return list(_history)
+
+
+def clear_history() -> None:
+    global _updates
+    _history.clear()
+    _updates = 0
+
+
+def to_image() -> Image.Image:
+    """Read the visible area of the framebuffer as an RGB image"""
+    with open(_path, "rb") as f:
+        data = f.read(_stride * _v_height * pixel_size())
+
+    image = Image.frombuffer(
+        "RGB",
+        (_v_width, _v_height),
+        data,
+        "raw",
+        "BGR;16",
+        _stride * pixel_size(),
+        1,
+    )
+    return image.crop((_x_offset, _y_offset, _x_offset + _width, _y_offset + _height))
+
+
+def dump(path: str) -> None:
+    to_image().save(path)
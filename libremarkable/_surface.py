@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from array import array
+
+from ctypes import sizeof
+
+from PIL import Image
+
+from ._color import color_t
+from ._color import getrgb
+from ._color import IMAGE_MODE
+
+from .geometry import Rect
+
+# Format character of color_t, used to view raw buffers as pixels
+PIXEL_FORMAT = color_t._type_
+
+
+def _copy_rows(
+    dst: memoryview,
+    dst_offset: int,
+    dst_stride: int,
+    src: memoryview,
+    src_offset: int,
+    src_stride: int,
+    width: int,
+    height: int,
+) -> None:
+    """Copy a block of pixel rows from one strided buffer to another"""
+    if width == dst_stride == src_stride:
+        size = width * height
+        dst[dst_offset : dst_offset + size] = src[src_offset : src_offset + size]
+        return
+
+    for _ in range(height):
+        dst[dst_offset : dst_offset + width] = src[src_offset : src_offset + width]
+        dst_offset += dst_stride
+        src_offset += src_stride
+
+
+def _move_rows(
+    buffer: memoryview,
+    src_offset: int,
+    dst_offset: int,
+    stride: int,
+    width: int,
+    height: int,
+) -> None:
+    """Copy a block of pixel rows within a buffer, safe when the source and
+    destination overlap"""
+    if width == stride:
+        size = width * height
+        buffer[dst_offset : dst_offset + size] = buffer[src_offset : src_offset + size]
+        return
+
+    if dst_offset > src_offset:
+        # Work from the bottom up so rows are read before being overwritten
+        src_offset += (height - 1) * stride
+        dst_offset += (height - 1) * stride
+        stride = -stride
+
+    for _ in range(height):
+        buffer[dst_offset : dst_offset + width] = buffer[
+            src_offset : src_offset + width
+        ]
+        src_offset += stride
+        dst_offset += stride
+
+
+def _fill_rows(
+    dst: memoryview,
+    offset: int,
+    stride: int,
+    width: int,
+    height: int,
+    color: int,
+) -> None:
+    """Fill a block of pixel rows in a strided buffer with a single color"""
+    if width == stride:
+        size = width * height
+        dst[offset : offset + size] = array(PIXEL_FORMAT, [color]) * size
+        return
+
+    row = array(PIXEL_FORMAT, [color]) * width
+    for _ in range(height):
+        dst[offset : offset + width] = row
+        offset += stride
+
+
+def _clip_source(surface: Surface, src_rect: Rect | None) -> tuple[int, int, int, int]:
+    if src_rect is None:
+        return 0, 0, surface.width, surface.height
+
+    left, top, right, bottom = src_rect.toInt()
+    assert 0 <= left < right <= surface.width, f"{src_rect} is invalid"
+    assert 0 <= top < bottom <= surface.height, f"{src_rect} is invalid"
+    return left, top, right - left, bottom - top
+
+
+class Surface:
+    """Off-screen RGB565 pixel buffer with the same layout as the framebuffer"""
+
+    def __init__(self, width: int, height: int, color: color_t | str | None = None):
+        assert width > 0, f"width of {width} is invalid"
+        assert height > 0, f"height of {height} is invalid"
+        self.width = width
+        self.height = height
+        self.buffer = bytearray(width * height * sizeof(color_t))
+        self.data = memoryview(self.buffer).cast(PIXEL_FORMAT)
+        if color is not None:
+            self.set_color(color)
+
+    def __repr__(self) -> str:
+        return f"Surface(width={self.width}, height={self.height})"
+
+    def __len__(self) -> int:
+        return self.width * self.height
+
+    @classmethod
+    def from_image(cls, image: Image) -> Surface:
+        surface = cls(image.width, image.height)
+        surface.draw_image(0, 0, image)
+        return surface
+
+    @property
+    def rect(self) -> Rect:
+        return Rect(0, 0, self.width, self.height)
+
+    def get_offset(self, x: int, y: int) -> int:
+        assert 0 <= x <= self.width, f"{x} not within bounds"
+        assert 0 <= y <= self.height, f"{y} not within bounds"
+        return y * self.width + x
+
+    def set_pixel(self, x: int, y: int, color: color_t | str) -> None:
+        if isinstance(color, str):
+            color = getrgb(color)
+
+        self.data[self.get_offset(x, y)] = color.value
+
+    def get_pixel(self, x: int, y: int) -> int:
+        return self.data[self.get_offset(x, y)]
+
+    def set_row(self, x: int, y: int, width: int, color: color_t | str) -> None:
+        self.set_rect(x, y, width, 1, color)
+
+    def get_row(self, x: int, y: int, width: int) -> tuple[int]:
+        offset = self.get_offset(x, y)
+        return tuple(self.data[offset : offset + width])
+
+    def set_rect(
+        self,
+        left: int,
+        top: int,
+        width: int,
+        height: int,
+        color: color_t | str,
+    ) -> None:
+        assert 0 <= left < self.width, f"left of {left} is invalid"
+        assert 0 <= top < self.height, f"top of {top} is invalid"
+        assert 0 < width <= self.width - left, f"width of {width} is invalid"
+        assert 0 < height <= self.height - top, f"height of {height} is invalid"
+        if isinstance(color, str):
+            color = getrgb(color)
+
+        _fill_rows(
+            self.data,
+            top * self.width + left,
+            self.width,
+            width,
+            height,
+            color.value,
+        )
+
+    def set_color(self, color: color_t | str) -> None:
+        self.set_rect(0, 0, self.width, self.height, color)
+
+    def draw_rect(
+        self,
+        left: int,
+        top: int,
+        right: int,
+        bottom: int,
+        color: color_t | str,
+        lineSize: int = 1,
+    ) -> None:
+        if isinstance(color, str):
+            color = getrgb(color)
+
+        self.set_rect(left, top, right - left, lineSize, color)  # Top line
+        self.set_rect(
+            left, bottom - lineSize, right - left, lineSize, color
+        )  # Bottom line
+        self.set_rect(left, top, lineSize, bottom - top, color)  # Left line
+        self.set_rect(
+            right - lineSize, top, lineSize, bottom - top, color
+        )  # Right line
+
+    def draw_image(self, left: int, top: int, image: Image) -> None:
+        width = image.width
+        height = image.height
+
+        assert 0 <= left < self.width, f"left of {left} is invalid"
+        assert 0 <= top < self.height, f"top of {top} is invalid"
+        assert 0 < width <= self.width - left, f"width of {width} is invalid"
+        assert 0 < height <= self.height - top, f"height of {height} is invalid"
+
+        if image.mode != IMAGE_MODE:
+            image = image.convert(IMAGE_MODE)
+
+        _copy_rows(
+            self.data,
+            top * self.width + left,
+            self.width,
+            memoryview(image.tobytes()).cast(PIXEL_FORMAT),
+            0,
+            width,
+            width,
+            height,
+        )
+
+    def blit(
+        self,
+        surface: Surface,
+        x: int,
+        y: int,
+        src_rect: Rect | None = None,
+    ) -> None:
+        left, top, width, height = _clip_source(surface, src_rect)
+        assert 0 <= x <= self.width - width, f"x of {x} is invalid"
+        assert 0 <= y <= self.height - height, f"y of {y} is invalid"
+        _copy_rows(
+            self.data,
+            y * self.width + x,
+            self.width,
+            surface.data,
+            top * surface.width + left,
+            surface.width,
+            width,
+            height,
+        )
+
+    def as_array(self):
+        # Requires numpy, the array shares memory with the surface
+        import numpy
+
+        return numpy.frombuffer(self.buffer, dtype=numpy.uint16).reshape(
+            self.height, self.width
+        )
+
+    def to_image(self) -> Image:
+        return Image.frombytes(IMAGE_MODE, (self.width, self.height), self.buffer)
@@ -0,0 +1,149 @@
+import os
+import struct
+
+from evdev import AbsInfo
+from evdev import InputEvent
+
+from evdev.ecodes import EV_ABS
+from evdev.ecodes import EV_KEY
+from evdev.ecodes import EV_SYN
+from evdev.ecodes import ABS_X
+from evdev.ecodes import ABS_Y
+from evdev.ecodes import ABS_PRESSURE
+from evdev.ecodes import ABS_DISTANCE
+from evdev.ecodes import ABS_TILT_X
+from evdev.ecodes import ABS_TILT_Y
+from evdev.ecodes import BTN_TOOL_PEN
+from evdev.ecodes import BTN_TOUCH
+from evdev.ecodes import BTN_STYLUS
+from evdev.ecodes import SYN_REPORT
+
+from ._input import DeviceInfo
+from ._input import READ_EVENTS
+
+# struct input_event on 64-bit kernels
+_EVENT = struct.Struct("llHHi")
+
+
+# Synthetic devices and input shared by test.py and the benchmarks
+
+
+class PenDevice:
+    path = "test-pen"
+
+
+# Axis ranges of the reMarkable 2 digitizer
+PEN_ABSINFO = {
+    ABS_X: AbsInfo(0, 0, 20967, 0, 0, 100),
+    ABS_Y: AbsInfo(0, 0, 15725, 0, 0, 100),
+    ABS_PRESSURE: AbsInfo(0, 0, 4095, 0, 0, 0),
+    ABS_DISTANCE: AbsInfo(0, 0, 255, 0, 0, 0),
+    ABS_TILT_X: AbsInfo(0, -9000, 9000, 0, 0, 0),
+    ABS_TILT_Y: AbsInfo(0, -9000, 9000, 0, 0, 0),
+}
+PEN_INFO = DeviceInfo(
+    PenDevice(),
+    (0, 0),
+    {
+        EV_ABS: frozenset(PEN_ABSINFO),
+        EV_KEY: frozenset([BTN_TOOL_PEN, BTN_TOUCH, BTN_STYLUS]),
+    },
+    PEN_ABSINFO,
+    "wacom",
+)
+
+
+def pen_stream(reports: int) -> list[list[InputEvent]]:
+    """Reports shaped like the digitizer's while drawing a stroke: the pen
+    hovers in, touches down, moves and lifts again"""
+    stream = [
+        [
+            InputEvent(0, 0, EV_KEY, BTN_TOOL_PEN, 1),
+            InputEvent(0, 0, EV_ABS, ABS_DISTANCE, 40),
+            InputEvent(0, 0, EV_SYN, SYN_REPORT, 0),
+        ],
+        [
+            InputEvent(0, 0, EV_KEY, BTN_TOUCH, 1),
+            InputEvent(0, 0, EV_ABS, ABS_DISTANCE, 0),
+            InputEvent(0, 0, EV_SYN, SYN_REPORT, 0),
+        ],
+    ]
+    for i in range(reports - 3):
+        stream.append(
+            [
+                InputEvent(0, i, EV_ABS, ABS_X, 1000 + i * 7),
+                InputEvent(0, i, EV_ABS, ABS_Y, 2000 + i * 3),
+                InputEvent(0, i, EV_ABS, ABS_PRESSURE, 1000 + i % 500),
+                InputEvent(0, i, EV_ABS, ABS_TILT_X, i % 100),
+                InputEvent(0, i, EV_ABS, ABS_TILT_Y, -(i % 100)),
+                InputEvent(0, i, EV_SYN, SYN_REPORT, 0),
+            ]
+        )
+
+    stream.append(
+        [
+            InputEvent(0, 0, EV_KEY, BTN_TOUCH, 0),
+            InputEvent(0, 0, EV_SYN, SYN_REPORT, 0),
+        ]
+    )
+    return stream
+
+
+class FakeDevice:
+    """Pipe standing in for an evdev device node. Like InputDevice, read()
+    returns at most READ_EVENTS events and raises BlockingIOError when there
+    are none"""
+
+    def __init__(
+        self,
+        path: str = "test-fake-pen",
+        capabilities: dict[int, list[int]] | None = None,
+        absinfo: dict[int, AbsInfo] | None = None,
+    ):
+        self.path = path
+        self.name = path
+        self._capabilities = (
+            capabilities
+            if capabilities is not None
+            else {EV_KEY: [BTN_TOOL_PEN, BTN_TOUCH, BTN_STYLUS]}
+        )
+        self._absinfo = absinfo if absinfo is not None else PEN_ABSINFO
+        self.fd, self._w = os.pipe()
+        os.set_blocking(self.fd, False)
+
+    def __repr__(self) -> str:
+        return f"FakeDevice({self.path!r})"
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def capabilities(self, verbose: bool = False, absinfo: bool = True) -> dict:
+        capabilities = dict(self._capabilities)
+        if self._absinfo:
+            capabilities[EV_ABS] = (
+                list(self._absinfo.items()) if absinfo else list(self._absinfo)
+            )
+
+        return capabilities
+
+    def absinfo(self, code: int) -> AbsInfo:
+        return self._absinfo[code]
+
+    def write(self, events: list[InputEvent]) -> None:
+        os.write(
+            self._w,
+            b"".join(
+                _EVENT.pack(e.sec, e.usec, e.type, e.code, e.value) for e in events
+            ),
+        )
+
+    def read(self):
+        data = os.read(self.fd, _EVENT.size * READ_EVENTS)
+        for sec, usec, type, code, value in _EVENT.iter_unpack(data):
+            yield InputEvent(sec, usec, type, code, value)
+
+    def close(self) -> None:
+        if self.fd > -1:
+            os.close(self.fd)
+            os.close(self._w)
+            self.fd = -1
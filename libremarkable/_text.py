@@ -0,0 +1,163 @@
+import math
+
+from functools import lru_cache
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+FONT_CACHE_SIZE = 16
+GLYPH_CACHE_SIZE = 1024
+KERNING_CACHE_SIZE = 4096
+LINE_SPACING = 4  # Same default spacing as ImageDraw.multiline_text
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def _font(path: str | None, size: int) -> ImageFont.FreeTypeFont:
+    if path is None:
+        return ImageFont.load_default(size=size)
+
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def _glyph(
+    path: str | None, size: int, char: str
+) -> tuple[Image.Image | None, tuple[int, int], float]:
+    """Render the coverage mask of a single character, along with the offset
+    to draw it at and how far to advance afterwards"""
+    font = _font(path, size)
+    left, top, right, bottom = font.getbbox(char)
+    advance = font.getlength(char)
+    if right <= left or bottom <= top:
+        return None, (0, 0), advance
+
+    mask = Image.new("L", (right - left, bottom - top))
+    ImageDraw.Draw(mask).text((-left, -top), char, 255, font=font)
+    return mask, (left, top), advance
+
+
+@lru_cache(maxsize=KERNING_CACHE_SIZE)
+def _kerning(path: str | None, size: int, pair: str) -> float:
+    """How much closer or further apart the font places a pair of characters
+    than their advances alone would"""
+    font = _font(path, size)
+    return font.getlength(pair) - font.getlength(pair[0]) - font.getlength(pair[1])
+
+
+def _over(a: int, b: int) -> int:
+    # Coverage of two overlapping glyphs, rounded the way Pillow's FreeType
+    # renderer does when it draws a line of text into one mask
+    product = a * b + 128
+    return a + b - (((product >> 8) + product) >> 8)
+
+
+def cache_info() -> dict:
+    return {
+        "fonts": _font.cache_info(),
+        "glyphs": _glyph.cache_info(),
+        "kerning": _kerning.cache_info(),
+    }
+
+
+def cache_clear() -> None:
+    _kerning.cache_clear()
+    _glyph.cache_clear()
+    _font.cache_clear()
+
+
+def text_length(text: str, size: int, path: str | None = None) -> float:
+    length = sum(_glyph(path, size, x)[2] for x in text)
+    for i in range(1, len(text)):
+        length += _kerning(path, size, text[i - 1 : i + 1])
+
+    return length
+
+
+def draw_text(
+    image: Image.Image,
+    xy: tuple[float, float],
+    text: str,
+    ink: int,
+    size: int,
+    path: str | None = None,
+) -> None:
+    if "\n" in text:
+        # ImageDraw.text does the same
+        draw_multiline_text(image, xy, text, ink, size, path)
+        return
+
+    # Like Pillow, start from the truncated position and round the pen
+    # position of each glyph to the nearest pixel, halves rounding up
+    x, y = xy
+    left = int(x)
+    top = int(y)
+    pen = x - left
+    y = top + math.floor(y - top + 0.5)
+    previous = None
+    glyphs = []
+    for char in text:
+        if previous is not None:
+            pen += _kerning(path, size, previous + char)
+
+        mask, (dx, dy), advance = _glyph(path, size, char)
+        if mask is not None:
+            glyphs.append((mask, left + math.floor(pen + 0.5) + dx, y + dy))
+
+        pen += advance
+        previous = char
+
+    if not glyphs:
+        return
+
+    # Pillow renders the whole line into one mask, blending the coverage of
+    # glyphs that overlap, and draws the ink through that once
+    x0 = min(x for _, x, _ in glyphs)
+    y0 = min(y for _, _, y in glyphs)
+    x1 = max(x + mask.width for mask, x, _ in glyphs)
+    y1 = max(y + mask.height for mask, _, y in glyphs)
+    line = Image.new("L", (x1 - x0, y1 - y0))
+    for mask, x, y in glyphs:
+        box = (x - x0, y - y0, x - x0 + mask.width, y - y0 + mask.height)
+        under = line.crop(box)
+        if under.getbbox() is not None:
+            mask = Image.frombytes(
+                "L",
+                mask.size,
+                bytes(map(_over, under.tobytes(), mask.tobytes())),
+            )
+
+        line.paste(mask, box)
+
+    image.paste(ink, (x0, y0), line)
+
+
+def draw_multiline_text(
+    image: Image.Image,
+    xy: tuple[float, float],
+    text: str,
+    ink: int,
+    size: int,
+    path: str | None = None,
+    align: str = "left",
+) -> None:
+    x, y = xy
+    lines = text.split("\n")
+    widths = [text_length(line, size, path) for line in lines]
+    maxWidth = max(widths)
+    lineHeight = _font(path, size).getbbox("A")[3] + LINE_SPACING
+    for line, width in zip(lines, widths):
+        if align == "left":
+            left = x
+
+        elif align == "center":
+            left = x + (maxWidth - width) / 2.0
+
+        elif align == "right":
+            left = x + maxWidth - width
+
+        else:
+            raise ValueError('align must be "left", "center" or "right"')
+
+        draw_text(image, (left, y), line, ink, size, path)
+        y += lineHeight
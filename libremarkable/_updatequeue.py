@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import time
+
+from threading import Condition
+from threading import Thread
+
+from collections.abc import Callable
+
+from dataclasses import dataclass
+
+from ._mxcfb import mxcfb_update_data
+from ._mxcfb import MXCFBException
+from ._rm2fb import RM2FBException
+
+MAX_ALIASES = 4096
+
+
+@dataclass
+class UpdateQueueStats:
+    requests: int = 0
+    updates: int = 0
+    pending: int = 0
+
+
+def _same_mode(a: mxcfb_update_data, b: mxcfb_update_data) -> bool:
+    return (
+        a.waveform_mode == b.waveform_mode
+        and a.update_mode == b.update_mode
+        and a.temp == b.temp
+        and a.flags == b.flags
+    )
+
+
+def _touching(a: mxcfb_update_data, b: mxcfb_update_data) -> bool:
+    ra = a.update_region
+    rb = b.update_region
+    # Overlapping or sharing an edge
+    return (
+        ra.left <= rb.left + rb.width
+        and rb.left <= ra.left + ra.width
+        and ra.top <= rb.top + rb.height
+        and rb.top <= ra.top + ra.height
+    )
+
+
+def _overlapping(a: mxcfb_update_data, b: mxcfb_update_data) -> bool:
+    ra = a.update_region
+    rb = b.update_region
+    return (
+        ra.left < rb.left + rb.width
+        and rb.left < ra.left + ra.width
+        and ra.top < rb.top + rb.height
+        and rb.top < ra.top + ra.height
+    )
+
+
+def _mergeable(a: mxcfb_update_data, b: mxcfb_update_data) -> bool:
+    return _same_mode(a, b) and _touching(a, b)
+
+
+def _barrier(a: mxcfb_update_data, b: mxcfb_update_data) -> bool:
+    # Updates with different settings that touch must reach the screen in the
+    # order they were queued
+    return not _same_mode(a, b) and _touching(a, b)
+
+
+def _merge(into: mxcfb_update_data, data: mxcfb_update_data) -> None:
+    a = into.update_region
+    b = data.update_region
+    left = min(a.left, b.left)
+    top = min(a.top, b.top)
+    right = max(a.left + a.width, b.left + b.width)
+    bottom = max(a.top + a.height, b.top + b.height)
+    a.left = left
+    a.top = top
+    a.width = right - left
+    a.height = bottom - top
+    into.update_marker = data.update_marker
+
+
+class UpdateQueue:
+    """Merges screen updates on a worker thread and submits them at most once
+    every latency_ms milliseconds"""
+
+    def __init__(
+        self,
+        submit: Callable[[mxcfb_update_data], None],
+        latency_ms: float = 20,
+    ):
+        self.submit = submit
+        self.latency_ms = latency_ms
+        self._condition = Condition()
+        self._pending: list[mxcfb_update_data] = []
+        self._aliases: dict[int, int] = {}
+        self._queued = 0
+        self._done = 0
+        self._flushing = 0
+        self._running = False
+        self._error = None
+        self._thread = None
+        self._stats = UpdateQueueStats()
+
+    def __repr__(self) -> str:
+        return f"UpdateQueue(latency_ms={self.latency_ms}, running={self._running})"
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        with self._condition:
+            if self._running:
+                return
+
+            self._running = True
+            self._thread = Thread(
+                target=self._run, name="libremarkable-updates", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            if not self._running:
+                return
+
+            self._running = False
+            self._condition.notify_all()
+
+        self._thread.join()
+        self._thread = None
+        self._raise()
+
+    def put(self, data: mxcfb_update_data) -> None:
+        data = mxcfb_update_data.from_buffer_copy(data)
+        with self._condition:
+            self._raise()
+            self._stats.requests += 1
+            self._queued += 1
+            # Merging into an update queued before a barrier would let data
+            # overtake it, so only look back as far as the newest barrier
+            for index in range(len(self._pending) - 1, -1, -1):
+                pending = self._pending[index]
+                if _mergeable(pending, data) and not self._covers_barrier(
+                    index, pending, data
+                ):
+                    self._alias(pending.update_marker, data.update_marker)
+                    _merge(pending, data)
+                    self._collapse(pending)
+                    break
+
+                if _touching(pending, data):
+                    self._pending.append(data)
+                    break
+
+            else:
+                self._pending.append(data)
+
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        with self._condition:
+            target = self._queued
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._done < target and self._running:
+                    self._condition.wait()
+
+            finally:
+                self._flushing -= 1
+
+            self._raise()
+
+    def resolve(self, marker: int) -> int:
+        with self._condition:
+            while marker in self._aliases:
+                marker = self._aliases[marker]
+
+            return marker
+
+    def stats(self) -> UpdateQueueStats:
+        with self._condition:
+            return UpdateQueueStats(
+                requests=self._stats.requests,
+                updates=self._stats.updates,
+                pending=len(self._pending),
+            )
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _alias(self, marker: int, target: int) -> None:
+        if marker == target:
+            return
+
+        if len(self._aliases) >= MAX_ALIASES:
+            del self._aliases[next(iter(self._aliases))]
+
+        self._aliases[marker] = target
+
+    def _covers_barrier(
+        self, index: int, into: mxcfb_update_data, data: mxcfb_update_data
+    ) -> bool:
+        # The merged update is sent from index, after everything queued before
+        # it. If its bounds reach an update with other settings queued there,
+        # that area would be refreshed again with settings never asked for
+        merged = mxcfb_update_data.from_buffer_copy(into)
+        _merge(merged, data)
+        return any(
+            not _same_mode(x, merged) and _overlapping(x, merged)
+            for x in self._pending[:index]
+        )
+
+    def _collapse(self, data: mxcfb_update_data) -> None:
+        # A grown update may now touch other pending updates. Each one merged
+        # moves to data's place in the queue, which is only allowed if it
+        # doesn't cross a barrier on the way
+        merged = True
+        while merged:
+            merged = False
+            index = next(i for i, x in enumerate(self._pending) if x is data)
+            for i, pending in enumerate(self._pending):
+                if pending is data or not _mergeable(data, pending):
+                    continue
+
+                between = self._pending[min(i, index) + 1 : max(i, index)]
+                if any(_barrier(x, pending) for x in between):
+                    continue
+
+                if self._covers_barrier(index, data, pending):
+                    continue
+
+                self._alias(pending.update_marker, data.update_marker)
+                marker = data.update_marker
+                _merge(data, pending)
+                data.update_marker = marker
+                self._pending.remove(pending)
+                merged = True
+                break
+
+    def _run(self) -> None:
+        last = 0
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                delay = last + self.latency_ms / 1000 - time.monotonic()
+                if delay > 0 and self._running and not self._flushing:
+                    self._condition.wait(delay)
+                    continue
+
+                batch = self._pending
+                self._pending = []
+                target = self._queued
+
+            try:
+                for data in batch:
+                    self.submit(data)
+
+            except (OSError, MXCFBException, RM2FBException) as e:
+                with self._condition:
+                    self._error = e
+
+            finally:
+                last = time.monotonic()
+                with self._condition:
+                    self._stats.updates += len(batch)
+                    self._done = target
+                    self._condition.notify_all()
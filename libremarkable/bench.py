@@ -0,0 +1,175 @@
+import sys
+import time
+import argparse
+
+from collections.abc import Callable
+
+from dataclasses import dataclass
+
+from PIL import Image
+
+from evdev import InputEvent
+
+from . import _simfb
+
+from ._device import DeviceType
+from ._device import current as deviceType
+
+from ._framebuffer import FrameBuffer
+
+from . import Input
+from . import DeviceInfo
+from . import TouchEvent
+from . import WacomEvent
+from . import _recording
+
+from ._input import _EventStates
+
+from ._testing import pen_stream
+from ._testing import PEN_INFO
+
+SIZES = (16, 128, 512)
+
+
+@dataclass
+class Result:
+    name: str
+    size: int | None
+    samples: list[int]
+
+    def percentile(self, q: float) -> float:
+        samples = sorted(self.samples)
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+    @property
+    def ops(self) -> float:
+        total = sum(self.samples)
+        return len(self.samples) / (total / 1_000_000_000) if total else float("inf")
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name:<16} {'-' if self.size is None else self.size:>6} "
+            f"{self.ops:>12.1f} {self.percentile(0.5) / 1000:>10.1f} "
+            f"{self.percentile(0.99) / 1000:>10.1f}"
+        )
+
+
+HEADER = (
+    f"{'benchmark':<16} {'size':>6} {'ops/sec':>12} {'p50 (us)':>10} {'p99 (us)':>10}"
+)
+
+
+def measure(
+    name: str, size: int | None, fn: Callable[[], None], repeat: int, warmup: int = 3
+) -> Result:
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - start)
+
+    return Result(name, size, samples)
+
+
+def _parse(reports: list[tuple[DeviceInfo, list[InputEvent]]], read: bool = False):
+    states = _EventStates(Input)
+    for info, events in reports:
+        for event in states.feed(info.device, events, info):
+            if read and isinstance(event, (TouchEvent, WacomEvent)):
+                _ = event.screenPos
+                _ = event.previousScreenPos
+                _ = event.pressure
+
+
+def benchmarks(
+    fb: FrameBuffer, trace: str | None = None
+) -> list[tuple[str, int | None, Callable[[], None]]]:
+    width = fb.width()
+    height = fb.height()
+    sizes = [x for x in SIZES if x <= min(width, height)]
+    black = fb.getcolor("black")
+    white = fb.getcolor("white")
+    items = [
+        ("set_pixel", None, lambda: fb.set_pixel(10, 10, black)),
+        ("set_color", None, lambda: fb.set_color(white)),
+        ("__contains__", None, lambda: fb.getcolor("red") in fb),
+    ]
+    for size in sizes:
+        image = Image.new("L", (size, size), 128)
+        values = [black] * (size * size)
+        items += [
+            ("set_rect", size, lambda s=size: fb.set_rect(0, 0, s, s, black)),
+            ("draw_rect", size, lambda s=size: fb.draw_rect(0, 0, s, s, black, 3)),
+            ("draw_line", size, lambda s=size: fb.draw_line(0, 0, s - 1, s - 1, black)),
+            ("draw_image", size, lambda i=image: fb.draw_image(0, 0, i)),
+            ("draw_text", size, lambda s=size: fb.draw_text(0, 0, s, s, "Hello")),
+            ("to_image", size, lambda s=size: fb.to_image(0, 0, s, s)),
+            ("__getitem__", size, lambda s=size: fb[0 : s * s]),
+            (
+                "__setitem__",
+                size,
+                lambda s=size, v=values: fb.__setitem__(slice(0, s * s), v),
+            ),
+        ]
+
+    image = Image.new("L", (width, height), 128)
+    items.append(("draw_image", max(width, height), lambda: fb.draw_image(0, 0, image)))
+    if trace is not None:
+        streams = [[(info, events) for _, info, events in _recording.read(trace)]]
+
+    else:
+        streams = [[(PEN_INFO, x) for x in pen_stream(size)] for size in (100, 1000)]
+
+    for stream in streams:
+        size = len(stream)
+        items.append(("Input.events", size, lambda s=stream: _parse(s)))
+        items.append(("Event.props", size, lambda s=stream: _parse(s, True)))
+
+    return items
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m libremarkable.bench",
+        description="Time framebuffer operations",
+    )
+    parser.add_argument("--repeat", type=int, default=50, help="Samples per benchmark")
+    parser.add_argument(
+        "--only", action="append", help="Only run the named benchmark(s)"
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        default=deviceType == DeviceType.UNKNOWN,
+        help="Use a simulated framebuffer (default when no device is detected)",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Parse a recording made with Input.record instead of a generated pen stroke",
+    )
+    args = parser.parse_args(argv)
+    from . import FrameBuffer as fb
+
+    if args.simulate and not _simfb.enabled():
+        fb.simulate()
+
+    print(f"Framebuffer: {fb.path()} {fb.width()}x{fb.height()}")
+    print(HEADER)
+    try:
+        for name, size, fn in benchmarks(fb, args.trace):
+            if args.only and name not in args.only:
+                continue
+
+            print(measure(name, size, fn, args.repeat), flush=True)
+
+    finally:
+        fb.release()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ from typing import Self
 from typing import Iterable
 from typing import overload
 
+from collections.abc import Iterator
 from collections.abc import MutableSet
 
 from itertools import product
@@ -153,6 +154,15 @@ class Rect:
     def toInt(self) -> Rect:
         return Rect(int(self.left), int(self.top), int(self.right), int(self.bottom))
 
+    def united(self, rect: Rect) -> Rect:
+        """Bounding rectangle of both"""
+        return Rect(
+            min(self.left, rect.left),
+            min(self.top, rect.top),
+            max(self.right, rect.right),
+            max(self.bottom, rect.bottom),
+        )
+
 
 class Region(MutableSet[Rect]):
     def __init__(self, *rects: list[Rect]) -> Self:
@@ -317,6 +327,18 @@ class Region(MutableSet[Rect]):
             self.elements.discard(r)
             self += list(r - rect)
 
+    def clear(self) -> None:
+        self.elements.clear()
+
+    def coalesce(self, overhead: float = 0) -> Region:
+        """Merge rectangles whose bounding rectangle covers no more area than
+        the two of them do separately, plus overhead. See Damage"""
+        damage = Damage(overhead)
+        for rect in sorted(self):
+            damage.add(rect)
+
+        return Region(*damage)
+
     @property
     def toInt(self) -> Region:
         return Region([x.toInt() for x in self])
@@ -336,3 +358,50 @@ __all__ = [
     "Rect",
     "Region",
 ]
+
+
+class Damage:
+    """Areas that have been drawn to and still need to be updated. Sending an
+    update is treated as costing its area plus overhead, and a rectangle is
+    merged with one already kept whenever their bounding rectangle costs no
+    more than sending both. Past limit rectangles everything is merged into
+    one, so adding stays cheap however much is drawn"""
+
+    def __init__(self, overhead: float = 0, limit: int | None = None):
+        self.overhead = overhead
+        self.limit = limit
+        self.rects: list[Rect] = []
+
+    def __repr__(self) -> str:
+        return f"Damage(rects={len(self)})"
+
+    def __iter__(self) -> Iterator[Rect]:
+        return iter(self.rects)
+
+    def __len__(self) -> int:
+        return len(self.rects)
+
+    def add(self, rect: Rect) -> None:
+        rects = self.rects
+        merged = True
+        while merged:
+            merged = False
+            # Drawing tends to continue next to what was drawn last
+            for i in range(len(rects) - 1, -1, -1):
+                bounds = rect.united(rects[i])
+                if bounds.area <= rect.area + rects[i].area + self.overhead:
+                    del rects[i]
+                    rect = bounds
+                    merged = True
+                    break
+
+        rects.append(rect)
+        if self.limit is not None and len(rects) > self.limit:
+            bounds = rects[0]
+            for x in rects:
+                bounds = bounds.united(x)
+
+            self.rects = [bounds]
+
+    def clear(self) -> None:
+        self.rects.clear()
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import time
+
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from collections.abc import Callable
+
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import replace
+
+from functools import wraps
+
+PRIMITIVES = (
+    "set_pixel",
+    "set_pixels",
+    "set_pixels_xy",
+    "set_row",
+    "set_col",
+    "set_rect",
+    "set_color",
+    "draw_rect",
+    "draw_line",
+    "draw_polyline",
+    "draw_image",
+    "draw_text",
+    "draw_multiline_text",
+    "blit",
+    "copy_rect",
+    "scroll",
+    "to_image",
+    "__setitem__",
+    "update",
+    "update_many",
+    "update_full",
+    "wait",
+    "poll",
+    "flush",
+)
+
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.calls if self.calls else 0
+
+
+@dataclass
+class UpdateStats:
+    updates: int = 0
+    area: int = 0
+
+
+@dataclass
+class Stats:
+    elapsed: float = 0
+    pixels: int = 0
+    calls: dict[str, CallStats] = field(default_factory=dict)
+    waveforms: dict[int, UpdateStats] = field(default_factory=dict)
+
+
+class _Collector:
+    def __init__(self):
+        self.lock = Lock()
+        self.start = time.monotonic()
+        self.pixels = 0
+        self.calls: dict[str, CallStats] = {}
+        self.waveforms: dict[int, UpdateStats] = {}
+
+    def add_pixels(self, pixels: int) -> None:
+        with self.lock:
+            self.pixels += pixels
+
+    def add_call(self, name: str, ns: int) -> None:
+        with self.lock:
+            stats = self.calls.get(name)
+            if stats is None:
+                stats = self.calls[name] = CallStats()
+
+            stats.calls += 1
+            stats.total_ns += ns
+            if ns > stats.max_ns:
+                stats.max_ns = ns
+
+    def add_update(self, waveform: int, area: int) -> None:
+        with self.lock:
+            stats = self.waveforms.get(waveform)
+            if stats is None:
+                stats = self.waveforms[waveform] = UpdateStats()
+
+            stats.updates += 1
+            stats.area += area
+
+    def snapshot(self) -> Stats:
+        with self.lock:
+            return Stats(
+                elapsed=time.monotonic() - self.start,
+                pixels=self.pixels,
+                calls={k: replace(v) for k, v in self.calls.items()},
+                waveforms={k: replace(v) for k, v in self.waveforms.items()},
+            )
+
+
+collector: _Collector | None = None
+_patched: list[tuple[object, str, object]] = []
+_dumper: tuple[Thread, Event] | None = None
+
+
+def _timed(name: str, fn: Callable) -> Callable:
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+
+        finally:
+            if collector is not None:
+                collector.add_call(name, time.perf_counter_ns() - start)
+
+    return wrapper
+
+
+def _submitted(name: str, fn: Callable) -> Callable:
+    from ._mxcfb import mxcfb_update_data
+
+    timed = _timed(name, fn)
+
+    @wraps(fn)
+    def wrapper(data, *args, **kwargs):
+        if collector is not None and isinstance(data, mxcfb_update_data):
+            region = data.update_region
+            collector.add_update(data.waveform_mode, region.width * region.height)
+
+        return timed(data, *args, **kwargs)
+
+    return wrapper
+
+
+def _submitted_many(name: str, fn: Callable) -> Callable:
+    timed = _timed(name, fn)
+
+    @wraps(fn)
+    def wrapper(updates, *args, **kwargs):
+        sent = timed(updates, *args, **kwargs)
+        if collector is not None:
+            for data in updates[:sent]:
+                region = data.update_region
+                collector.add_update(data.waveform_mode, region.width * region.height)
+
+        return sent
+
+    return wrapper
+
+
+def _patch(owner: object, attr: str, wrapper: object) -> None:
+    _patched.append((owner, attr, owner.__dict__[attr]))
+    setattr(owner, attr, wrapper)
+
+
+def _instrument() -> None:
+    from . import _mxcfb
+    from . import _rm2fb
+    from . import _simfb
+
+    from ._framebuffer import FrameBuffer
+
+    for name in PRIMITIVES:
+        method = FrameBuffer.__dict__[name]
+        _patch(
+            FrameBuffer,
+            name,
+            type(method)(_timed(f"FrameBuffer.{name}", method.__func__)),
+        )
+
+    send = _submitted("_rm2fb.send", _rm2fb.send)
+    _patch(_rm2fb, "send", send)
+    _patch(_rm2fb, "update", send)
+    # The other backends submit batches through their instrumented update
+    _patch(
+        _rm2fb, "update_many", _submitted_many("_rm2fb.update_many", _rm2fb.update_many)
+    )
+    _patch(_mxcfb, "update", _submitted("_mxcfb.update", _mxcfb.update))
+    _patch(_simfb, "update", _submitted("_simfb.update", _simfb.update))
+
+
+def _dump_loop(callback: Callable[[Stats], None], interval: float, stop: Event):
+    while not stop.wait(interval):
+        current = collector
+        if current is not None:
+            callback(current.snapshot())
+
+
+def enabled() -> bool:
+    return collector is not None
+
+
+def enable(dump: Callable[[Stats], None] | None = None, interval: float = 60) -> None:
+    """Start collecting statistics, optionally passing a snapshot to dump every
+    interval seconds"""
+    global collector
+    global _dumper
+    if collector is None:
+        collector = _Collector()
+        _instrument()
+
+    if _dumper is not None:
+        _dumper[1].set()
+        _dumper = None
+
+    if dump is not None:
+        stop = Event()
+        thread = Thread(
+            target=_dump_loop,
+            args=(dump, interval, stop),
+            name="libremarkable-stats",
+            daemon=True,
+        )
+        thread.start()
+        _dumper = (thread, stop)
+
+
+def disable() -> None:
+    global collector
+    global _dumper
+    if _dumper is not None:
+        _dumper[1].set()
+        _dumper = None
+
+    while _patched:
+        owner, attr, original = _patched.pop()
+        setattr(owner, attr, original)
+
+    collector = None
+
+
+def stats() -> Stats:
+    if collector is None:
+        return Stats()
+
+    return collector.snapshot()
+
+
+def reset() -> None:
+    global collector
+    if collector is not None:
+        collector = _Collector()
+
+
+__all__ = [
+    "CallStats",
+    "UpdateStats",
+    "Stats",
+    "enable",
+    "disable",
+    "enabled",
+    "stats",
+    "reset",
+]
@@ -4,18 +4,84 @@
 # nuitka-project: --onefile
 # nuitka-project: --lto=yes
 
+import os
+import math
+import errno
+import asyncio
 import sys
 import difflib
+import tempfile
+import threading
 
+from array import array
+
+from contextlib import aclosing
+
+from ctypes import addressof
+from ctypes import memmove
 from ctypes import sizeof
 
+try:
+    import numpy
+
+except ImportError:
+    numpy = None
+
+from PIL import Image
 from PIL import ImageColor
+from PIL import ImageDraw
+from PIL import ImageFont
+
+from evdev import AbsInfo
+from evdev import InputEvent
+
+from evdev.ecodes import EV_ABS
+from evdev.ecodes import EV_KEY
+from evdev.ecodes import EV_SYN
+from evdev.ecodes import ABS_X
+from evdev.ecodes import ABS_Y
+from evdev.ecodes import ABS_MT_TRACKING_ID
+from evdev.ecodes import BTN_STYLUS
+from evdev.ecodes import BTN_TOOL_PEN
+from evdev.ecodes import BTN_TOUCH
+from evdev.ecodes import SYN_REPORT
+from evdev.ecodes import KEY_A
 
 from libremarkable import FrameBuffer as fb
 from libremarkable import DeviceType
 from libremarkable import deviceType
+from libremarkable import Input
+from libremarkable import InputReader
+from libremarkable import Surface
+from libremarkable import WaveformMode
 
+from libremarkable import _simfb
+from libremarkable import _mxcfb
+from libremarkable import _rm2fb
+from libremarkable._libc import sem_close
+from libremarkable._libc import sem_post
+from libremarkable._libc import sem_unlink
 from libremarkable._mxcfb import MXCFB_SEND_UPDATE
+from libremarkable._mxcfb import mxcfb_update_data
+from libremarkable._mxcfb import fb_fix_screeninfo
+from libremarkable._mxcfb import fb_var_screeninfo
+from libremarkable._mxcfb import ScreenInfo
+from libremarkable._updatequeue import UpdateQueue
+from libremarkable import _text
+from libremarkable import _raster
+from libremarkable._surface import _move_rows
+from libremarkable._input import _classify
+from libremarkable._input import _EventStates
+from libremarkable._input import ScreenTransform
+from libremarkable._input import _coalesce
+from libremarkable._input import _Resync
+from libremarkable._input import _Registry
+from libremarkable._input import _hotplug
+from libremarkable._input import _watch
+from libremarkable._recording import Recorder
+from libremarkable._testing import pen_stream
+from libremarkable._testing import PEN_INFO
+from libremarkable._testing import FakeDevice
 
 
 from libremarkable._color import color_t
@@ -25,6 +91,12 @@ from libremarkable._color import rgb888_to_rgb565
 from libremarkable.geometry import Point
 from libremarkable.geometry import Rect
 from libremarkable.geometry import Region
+from libremarkable.geometry import Damage
+
+from libremarkable import instrumentation
+from libremarkable import _framebuffer
+from libremarkable._framebuffer import MAX_DAMAGE_RECTS
+from libremarkable._framebuffer import UPDATE_OVERHEAD
 
 
 FAILED = False
@@ -80,11 +152,333 @@ color888 = ImageColor.getrgb("black")
 assertv("rgb565_to_rgb888(black)", rgb565_to_rgb888(0x0000), color888)
 assertv("rgb888_to_rgb565(black)", rgb888_to_rgb565(*color888), 0x0000)
 assertv("MXCFB_SEND_UPDATE", MXCFB_SEND_UPDATE, 0x4048462E)
+info = ScreenInfo(
+    fb_var_screeninfo(xres=1404, xres_virtual=1404, bits_per_pixel=16),
+    fb_fix_screeninfo(line_length=2816),
+)
+assertv("ScreenInfo.stride", info.stride, 1408)
+assertv("ScreenInfo.pixel_size", info.pixel_size, 2)
 if deviceType != DeviceType.UNKNOWN:
     assertv("get_offset", fb.get_offset(0, 0), 0)
     asserti("get_pixel", fb.get_pixel(0, 0), int)
     assertv("pixel_size", fb.pixel_size(), sizeof(color_t))
 
+else:
+    _simfb.configure(width=4, height=4)
+    _simfb.setup()
+    path = _simfb.path()
+    assertv("simulated default path created", path in _simfb._created, True)
+    _simfb._remove_created()
+    assertv("simulated default path removed", os.path.exists(path), False)
+    fb.simulate(
+        path=os.path.join(tempfile.gettempdir(), "libremarkable-test.simfb"),
+        width=32,
+        height=16,
+        virtual_width=40,
+        virtual_height=20,
+        x_offset=4,
+        y_offset=2,
+        stride=44,
+    )
+    assertv("simulated stride", fb.stride(), 44)
+    assertv("simulated get_offset", fb.get_offset(0, 0), 92)
+    fb.set_color("white")
+    fb.set_rect(1, 1, 2, 2, "black")
+    asserta(
+        "simulated set_rect",
+        [fb.get_row(0, y, 4) for y in range(0, 4)],
+        [
+            [0xFFFF, 0xFFFF, 0xFFFF, 0xFFFF],
+            [0xFFFF, 0x0000, 0x0000, 0xFFFF],
+            [0xFFFF, 0x0000, 0x0000, 0xFFFF],
+            [0xFFFF, 0xFFFF, 0xFFFF, 0xFFFF],
+        ],
+    )
+    fb.blit(Surface(2, 1, "black"), 30, 15)
+    assertv("simulated blit", fb.get_row(29, 15, 3), [0xFFFF, 0x0000, 0x0000])
+    fb.draw_image(0, 0, fb.to_image(1, 1, 2, 2))
+    assertv("simulated draw_image", fb.get_row(0, 0, 3), [0x0000, 0x0000, 0xFFFF])
+    fb.scroll(Rect(0, 0, 4, 4), 0, 1, "white")
+    assertv("simulated scroll", fb.get_row(0, 0, 3), [0xFFFF, 0xFFFF, 0xFFFF])
+    assertv("simulated scroll moved", fb.get_row(0, 1, 3), [0x0000, 0x0000, 0xFFFF])
+    fb.track_damage()
+    fb.set_pixel(5, 5, "black")
+    fb.draw_line(5, 6, 5, 8, "black")
+    fb.flush(WaveformMode.Mono, sync=True)
+    fb.track_damage(False)
+    asserta(
+        "simulated flush",
+        [(x.kind, x.left, x.top, x.width, x.height) for x in _simfb.history()],
+        [
+            ("update", 5, 5, 1, 4),
+            ("wait", 0, 0, 0, 0),
+        ],
+    )
+    assertv("simulated to_image", _simfb.to_image().getpixel((5, 5)), (0, 0, 0))
+    instrumentation.enable()
+    fb.set_rect(0, 0, 4, 4, "black")
+    fb.update(0, 0, 4, 4, WaveformMode.Mono)
+    stats = instrumentation.stats()
+    instrumentation.disable()
+    assertv("instrumentation pixels", stats.pixels, 16)
+    assertv("instrumentation calls", stats.calls["FrameBuffer.set_rect"].calls, 1)
+    assertv("instrumentation area", stats.waveforms[WaveformMode.Mono].area, 16)
+    assertv("instrumentation disabled", instrumentation.enabled(), False)
+    _simfb.clear_history()
+    marker = fb.update(0, 0, 4, 4, WaveformMode.Mono)
+    assertv("poll", fb.poll(marker), True)
+    asyncio.run(fb.wait_async(marker, 1))
+    assertv(
+        "wait_async",
+        [(x.kind, x.marker) for x in _simfb.history()],
+        [("update", marker), ("poll", marker), ("wait", marker)],
+    )
+    _simfb.clear_history()
+    markers = fb.update_many(
+        [
+            (Rect(0, 0, 4, 4), WaveformMode.Mono),
+            (Rect(8, 2, 10, 6), WaveformMode.Grayscale),
+        ]
+    )
+    assertv(
+        "update_many",
+        [(x.marker, x.left, x.top, x.width, x.height) for x in _simfb.history()],
+        [(markers[0], 0, 0, 4, 4), (markers[1], 8, 2, 2, 4)],
+    )
+    _simfb.clear_history()
+    markers = fb.update_many(
+        [(Rect(0, 0, 4, 4), WaveformMode.Mono)] * 3,
+        sync=True,
+    )
+    assertv(
+        "update_many sync",
+        [(x.kind, x.marker) for x in _simfb.history()],
+        [("update", x) for x in markers] + [("wait", markers[-1])],
+    )
+    fb.set_color("white")
+    fb.track_damage()
+    rect = fb.draw_polyline([(2, 5), (8, 5)], "black", width=3, cap="butt")
+    assertv("draw_polyline", rect, Rect(2, 4, 9, 7))
+    assertv("draw_polyline damage", list(fb.damage()), [rect])
+    row = [0xFFFF] + [0x0000] * 7 + [0xFFFF]
+    asserta(
+        "draw_polyline pixels",
+        [fb.get_row(1, y, 9) for y in range(3, 8)],
+        [[0xFFFF] * 9, row, row, row, [0xFFFF] * 9],
+    )
+    _simfb.clear_history()
+    fb.update_many([(rect, WaveformMode.Mono)])
+    assertv(
+        "draw_polyline update_many",
+        [(x.left, x.top, x.width, x.height) for x in _simfb.history()],
+        [(2, 4, 7, 3)],
+    )
+    fb.track_damage(False)
+    fb.set_color("white")
+    fb.set_pixel(1, 1, "black")
+    fb.track_damage()
+    fb.copy_rect(Rect(0, 0, 3, 3), Point(10, 2))
+    asserta(
+        "copy_rect",
+        [fb.get_row(10, y, 3) for y in range(2, 5)],
+        [[0xFFFF] * 3, [0xFFFF, 0x0000, 0xFFFF], [0xFFFF] * 3],
+    )
+    assertv("copy_rect damage", list(fb.damage()), [Rect(10, 2, 13, 5)])
+    fb.track_damage(False)
+    fb.set_pixel(0, 0, "black")
+    fb.scroll(Rect(0, 0, 4, 1), 2, 0, "white")
+    assertv("scroll dx", fb.get_row(0, 0, 4), [0xFFFF, 0xFFFF, 0x0000, 0xFFFF])
+    fb.scroll(Rect(0, 0, 4, 1), -5, 0, "black")
+    assertv("scroll past edge", fb.get_row(0, 0, 4), [0x0000] * 4)
+    points = [(0, 0), (31, 0), (5, 7), (6, 7), (31, 15), (12, 3)]
+    colors = ["black", "gray", "black", "white", "black", "gray"]
+    fb.set_color("white")
+    for (x, y), color in zip(points, colors):
+        fb.set_pixel(x, y, color)
+
+    expected = [fb.get_row(0, y, 32) for y in range(16)]
+    fb.set_color("white")
+    xs, ys = zip(*points)
+    fb.set_pixels_xy(xs, ys, colors)
+    asserta("set_pixels_xy", [fb.get_row(0, y, 32) for y in range(16)], expected)
+    fb.set_color("white")
+    for x, y in points:
+        fb.set_pixel(x, y, "black")
+
+    expected = [fb.get_row(0, y, 32) for y in range(16)]
+    fb.set_color("white")
+    fb.set_pixels([Point(x, y) for x, y in points], "black")
+    asserta("set_pixels", [fb.get_row(0, y, 32) for y in range(16)], expected)
+    if numpy is not None:
+        fb.set_color("white")
+        fb.set_pixels_xy(numpy.array(xs), numpy.array(ys), "black")
+        asserta(
+            "set_pixels_xy numpy",
+            [fb.get_row(0, y, 32) for y in range(16)],
+            expected,
+        )
+
+    if numpy is not None:
+        fb.set_color("white")
+        pixels = fb.as_array()
+        assertv("as_array shape", pixels.shape, (16, 32))
+        assertv("as_array strides", pixels.strides, (44 * 2, 2))
+        pixels[3, 5] = 0x0000
+        assertv("as_array write", fb.get_pixel(5, 3), 0x0000)
+        fb.set_pixel(31, 15, "black")
+        assertv("as_array read", int(pixels[15, 31]), 0x0000)
+        assertv("as_array untouched", int(pixels[3, 4]), 0xFFFF)
+        del pixels
+
+    for _ in range(_simfb.HISTORY_SIZE + 1):
+        _simfb.poll(0)
+
+    assertv("simulated history bounded", len(_simfb.history()), _simfb.HISTORY_SIZE)
+    fb.release()
+    os.unlink(fb.path())
+
+environ = os.environ.get(_simfb.ENV)
+try:
+    enabled = []
+    for value in ("1", "true", "0", "false", ""):
+        os.environ[_simfb.ENV] = value
+        enabled.append(_simfb._enabled_from_env())
+
+    assertv("_simfb._enabled_from_env", enabled, [True, True, False, False, False])
+
+finally:
+    if environ is None:
+        os.environ.pop(_simfb.ENV, None)
+
+    else:
+        os.environ[_simfb.ENV] = environ
+
+displayed = threading.Event()
+wait = _mxcfb.wait
+_mxcfb.wait = lambda marker, timeout=None: displayed.wait()
+try:
+    assertv("_mxcfb.poll pending", _mxcfb.poll(7), False)
+    displayed.set()
+    _mxcfb._polls[7][0].join()
+    assertv("_mxcfb.poll done", (_mxcfb.poll(7), _mxcfb._polls), (True, {}))
+    displayed.clear()
+    assertv("_mxcfb.poll new", [_mxcfb.poll(x) for x in (8, 9)], [False, False])
+    displayed.set()
+    for thread, _ in list(_mxcfb._polls.values()):
+        thread.join()
+
+    displayed.clear()
+    # Markers polled once are forgotten once they finish
+    assertv(
+        "_mxcfb.poll forgets", (_mxcfb.poll(10), list(_mxcfb._polls)), (False, [10])
+    )
+    assertv("_mxcfb.poll older", _mxcfb.poll(8), True)
+    displayed.set()
+    _mxcfb._polls[10][0].join()
+    assertv("_mxcfb.poll newest", (_mxcfb.poll(10), _mxcfb._polls), (True, {}))
+
+finally:
+    _mxcfb.wait = wait
+    _mxcfb._completed = 0
+
+if deviceType == DeviceType.UNKNOWN:
+    queried = []
+    mode = fb_var_screeninfo(
+        xres=4, xres_virtual=4, yres=2, yres_virtual=2, bits_per_pixel=16
+    )
+
+    def query(fd, request, info):
+        queried.append((fd, request))
+        if request == _mxcfb.FBIOPUT_VSCREENINFO:
+            global mode
+            mode = fb_var_screeninfo.from_buffer_copy(info)
+
+        elif isinstance(info, fb_var_screeninfo):
+            memmove(addressof(info), addressof(mode), sizeof(mode))
+
+        elif isinstance(info, fb_fix_screeninfo):
+            info.smem_len = 4096
+
+        return info
+
+    fd, path = tempfile.mkstemp()
+    os.ftruncate(fd, 4096)
+    os.close(fd)
+    implementation = _framebuffer.implementation
+    _framebuffer.implementation = lambda: _mxcfb
+    query_, path_, fb_path = _mxcfb._query, _mxcfb.path, _mxcfb.FB_PATH
+    _mxcfb._query = query
+    _mxcfb.path = lambda: path
+    _mxcfb.FB_PATH = path
+    _mxcfb.invalidate()
+    try:
+        with fb.mmap():
+            fileno = _framebuffer._fb["f"].fileno()
+
+        # Mapping reads the screen info through the file it maps
+        assertv("_mxcfb.screen_info mapped fd", {x for x, _ in queried}, {fileno})
+        assertv("_mxcfb.screen_info mapped width", fb.width(), 4)
+        _mxcfb.put_var_screeninfo(
+            fb_var_screeninfo(
+                xres=8, xres_virtual=8, yres=2, yres_virtual=2, bits_per_pixel=16
+            )
+        )
+        assertv("_mxcfb.put_var_screeninfo releases", _framebuffer._fb, None)
+        with fb.mmap():
+            image = _framebuffer._fb["image"]
+
+        assertv("_mxcfb.put_var_screeninfo remapped", image.size, (8, 2))
+
+    finally:
+        _mxcfb._query, _mxcfb.path, _mxcfb.FB_PATH = query_, path_, fb_path
+        fb.release()
+        _mxcfb.invalidate()
+        _framebuffer.implementation = implementation
+        os.unlink(path)
+
+requests = []
+send = _rm2fb.send
+_rm2fb.send = requests.append
+try:
+    assertv("_rm2fb.poll pending", (_rm2fb.poll(1), _rm2fb.poll(2)), (False, False))
+    # The server answers requests in order, one post each
+    sem_post(_rm2fb._sem())
+    assertv("_rm2fb.poll in order", (_rm2fb.poll(2), _rm2fb.poll(1)), (False, True))
+    sem_post(_rm2fb._sem())
+    _rm2fb.wait(2, 1)
+    assertv("_rm2fb.wait", (len(requests), _rm2fb._requests), (2, {}))
+    assertv("_rm2fb.poll before waiters", _rm2fb.poll(3), False)
+    timeouts = []
+
+    def waiter(marker):
+        try:
+            _rm2fb.wait(marker, 3)
+
+        except TimeoutError:
+            timeouts.append(marker)
+
+    waiters = [threading.Thread(target=waiter, args=(x,)) for x in (4, 3)]
+    for x in waiters:
+        x.start()
+
+    while len(requests) < 4:
+        threading.Event().wait(0.01)
+
+    threading.Event().wait(0.1)
+    sem_post(_rm2fb._sem())
+    sem_post(_rm2fb._sem())
+    for x in waiters:
+        x.join()
+
+    assertv("_rm2fb.wait concurrent", (timeouts, _rm2fb._requests), ([], {}))
+
+finally:
+    _rm2fb.send = send
+    sem_unlink(_rm2fb._sem_name())
+    sem_close(_rm2fb._semaphore)
+    _rm2fb._semaphore = None
+    _rm2fb._sent = _rm2fb._posted = 0
+
 a = Point(0, 0)
 b = Point(10, 10)
 assertv(f"{a} < {b}", a < b, True)
@@ -238,6 +632,54 @@ a = Region(
 )
 assertv(f"{a}.boundingRect", a.boundingRect, Rect(0, 0, 20, 20))
 
+a = Region(Rect(5, 5, 10, 10)) + Rect(5, 5, 20, 20)
+asserta(f"{a}.coalesce()", sorted(a.coalesce()), [Rect(5, 5, 20, 20)])
+
+a = Region(Rect(0, 0, 10, 10), Rect(0, 10, 10, 20), Rect(30, 30, 40, 40))
+asserta(
+    f"{a}.coalesce()",
+    sorted(a.coalesce()),
+    [
+        Rect(0, 0, 10, 20),
+        Rect(30, 30, 40, 40),
+    ],
+)
+
+a = Region(Rect(0, 0, 10, 10), Rect(10, 0, 20, 10), Rect(5, 5, 15, 30))
+asserta(
+    f"{a}.coalesce() overlapping",
+    sorted(a.coalesce()),
+    [Rect(0, 0, 20, 10), Rect(5, 5, 15, 30)],
+)
+asserta(f"{a}.coalesce(overhead)", list(a.coalesce(200)), [Rect(0, 0, 20, 30)])
+
+damage = Damage(UPDATE_OVERHEAD, MAX_DAMAGE_RECTS)
+stroke = [
+    (
+        int(700 + 500 * math.cos(i / 30) * math.sin(i / 47)),
+        int(900 + 700 * math.sin(i / 25)),
+    )
+    for i in range(301)
+]
+segments = [
+    Rect(min(x1, x2), min(y1, y2), max(x1, x2) + 1, max(y1, y2) + 1)
+    for (x1, y1), (x2, y2) in zip(stroke, stroke[1:])
+]
+for rect in segments:
+    damage.add(rect)
+
+assertv("Damage stroke", len(damage) <= 16, True)
+assertv(
+    "Damage stroke covered",
+    all(any(x in rect for rect in damage) for x in segments),
+    True,
+)
+damage = Damage(limit=2)
+for x in range(3):
+    damage.add(Rect(x * 10, 0, x * 10 + 1, 1))
+
+assertv("Damage bounding fallback", list(damage), [Rect(0, 0, 21, 1)])
+
 a = Rect(0, 0, 20, 20)
 b = Rect(10, 10, 20, 30)
 asserta(
@@ -251,5 +693,509 @@ asserta(
     ),
 )
 
+surface = Surface(4, 3, "white")
+assertv("Surface.get_pixel", surface.get_pixel(3, 2), 0xFFFF)
+surface.set_rect(1, 1, 2, 2, "black")
+asserta(
+    "Surface.set_rect",
+    [surface.get_row(0, y, 4) for y in range(0, 3)],
+    [
+        (0xFFFF, 0xFFFF, 0xFFFF, 0xFFFF),
+        (0xFFFF, 0x0000, 0x0000, 0xFFFF),
+        (0xFFFF, 0x0000, 0x0000, 0xFFFF),
+    ],
+)
+target = Surface(3, 2, "black")
+target.blit(surface, 1, 0, Rect(2, 0, 4, 2))
+asserta(
+    "Surface.blit",
+    [target.get_row(0, y, 3) for y in range(0, 2)],
+    [
+        (0x0000, 0xFFFF, 0xFFFF),
+        (0x0000, 0x0000, 0xFFFF),
+    ],
+)
+assertv(
+    "Surface.from_image",
+    Surface.from_image(surface.to_image()).buffer,
+    surface.buffer,
+)
+
+submitted = []
+queue = UpdateQueue(
+    lambda data: submitted.append(
+        (
+            data.update_region.left,
+            data.update_region.top,
+            data.update_region.width,
+            data.update_region.height,
+            data.update_marker,
+        )
+    ),
+    latency_ms=1000,
+)
+for marker, (left, waveform) in enumerate([(0, 1), (10, 1), (20, 1), (10, 2)]):
+    data = mxcfb_update_data()
+    data.update_region.left = left
+    data.update_region.width = 10
+    data.update_region.height = 10
+    data.waveform_mode = waveform
+    data.update_marker = marker + 1
+    queue.put(data)
+
+queue.start()
+queue.flush()
+queue.stop()
+asserta(
+    "UpdateQueue merge",
+    submitted,
+    [
+        (0, 0, 30, 10, 3),
+        (10, 0, 10, 10, 4),
+    ],
+)
+assertv("UpdateQueue.resolve", queue.resolve(1), 3)
+assertv("UpdateQueue.stats", queue.stats().updates, 2)
+
+
+def queued(updates):
+    submitted = []
+    queue = UpdateQueue(
+        lambda data: submitted.append(
+            (
+                data.update_region.left,
+                data.update_region.top,
+                data.update_region.width,
+                data.update_region.height,
+                data.update_marker,
+            )
+        ),
+        latency_ms=1000,
+    )
+    for marker, (left, top, width, height, waveform) in enumerate(updates):
+        data = mxcfb_update_data()
+        data.update_region.left = left
+        data.update_region.top = top
+        data.update_region.width = width
+        data.update_region.height = height
+        data.waveform_mode = waveform
+        data.update_marker = marker + 1
+        queue.put(data)
+
+    queue.start()
+    queue.flush()
+    queue.stop()
+    return submitted
+
+
+asserta(
+    "UpdateQueue barrier",
+    queued([(0, 0, 10, 10, 1), (0, 0, 10, 10, 2), (0, 0, 10, 10, 1)]),
+    [(0, 0, 10, 10, 1), (0, 0, 10, 10, 2), (0, 0, 10, 10, 3)],
+)
+asserta(
+    "UpdateQueue merged bounds barrier",
+    queued([(20, 7, 5, 3, 2), (0, 0, 10, 10, 1), (10, 0, 20, 5, 1)]),
+    [(20, 7, 5, 3, 1), (0, 0, 10, 10, 2), (10, 0, 20, 5, 3)],
+)
+asserta(
+    "UpdateQueue collapse barrier",
+    queued(
+        [
+            (0, 0, 10, 10, 1),
+            (5, 10, 10, 10, 2),
+            (20, 0, 10, 10, 1),
+            (10, 0, 20, 5, 1),
+        ]
+    ),
+    [(0, 0, 10, 10, 1), (5, 10, 10, 10, 2), (10, 0, 20, 10, 4)],
+)
+
+expected = Image.new("I;16", (200, 40), 0xFFFF)
+d = ImageDraw.Draw(expected)
+d.fontmode = "L"
+d.text((0, 0), "Hello World!", 0, font=ImageFont.load_default(size=24))
+image = Image.new("I;16", (200, 40), 0xFFFF)
+_text.draw_text(image, (0, 0), "Hello World!", 0, 24)
+assertv("_text.draw_text", image.tobytes(), expected.tobytes())
+_text.draw_text(image, (0, 0), "Hello World!", 0, 24)
+assertv("_text.cache_info", _text.cache_info()["glyphs"].hits > 0, True)
+
+for text in ("AVAToy fi", "Wa.ff"):
+    # Glyphs that overlap at a small size, in colours where blending them one
+    # at a time would show
+    expected = Image.new("I;16", (80, 20), 0xABCD)
+    d = ImageDraw.Draw(expected)
+    d.fontmode = "L"
+    d.text((0.5, 1), text, 0x1234, font=ImageFont.load_default(size=12))
+    image = Image.new("I;16", (80, 20), 0xABCD)
+    _text.draw_text(image, (0.5, 1), text, 0x1234, 12)
+    assertv(f"_text.draw_text {text!r}", image.tobytes(), expected.tobytes())
+
+for align in ("left", "center", "right"):
+    expected = Image.new("I;16", (200, 100), 0xFFFF)
+    d = ImageDraw.Draw(expected)
+    d.fontmode = "L"
+    d.text(
+        (0.5, 0), "x\nmm\nAV lll.", 0, font=ImageFont.load_default(size=24), align=align
+    )
+    image = Image.new("I;16", (200, 100), 0xFFFF)
+    if align == "left":
+        _text.draw_text(image, (0.5, 0), "x\nmm\nAV lll.", 0, 24)
+
+    else:
+        _text.draw_multiline_text(image, (0.5, 0), "x\nmm\nAV lll.", 0, 24, None, align)
+
+    assertv(f"_text.draw_multiline_text {align}", image.tobytes(), expected.tobytes())
+
+spans = _raster.polyline_spans([(2, 5), (8, 5)], 20, 20, 3, cap="butt")
+assertv("polyline_spans butt", spans, {4: [(2, 8)], 5: [(2, 8)], 6: [(2, 8)]})
+assertv("spans_rect", _raster.spans_rect(spans), Rect(2, 4, 9, 7))
+spans = _raster.polyline_spans([(0, 0), (3, 0), (3, 2)], 20, 20)
+assertv("polyline_spans width=1", spans, {0: [(0, 3)], 1: [(3, 3)], 2: [(3, 3)]})
+spans = _raster.polyline_spans([(5, 5)], 20, 20, 5)
+assertv(
+    "polyline_spans dot",
+    spans,
+    {3: [(4, 6)], 4: [(3, 7)], 5: [(3, 7)], 6: [(3, 7)], 7: [(4, 6)]},
+)
+spans = _raster.polyline_spans([(-5, 1), (5, 1)], 4, 4, 3, cap="square")
+assertv("polyline_spans clipped", _raster.spans_rect(spans), Rect(0, 0, 4, 3))
+
+surface = Surface(3, 3)
+surface.data[:] = array("H", range(0, 9))
+_move_rows(surface.data, 0, 4, 3, 2, 2)
+assertv("_move_rows down", surface.data.tolist(), [0, 1, 2, 3, 0, 1, 6, 3, 4])
+_move_rows(surface.data, 4, 0, 3, 2, 2)
+assertv("_move_rows up", surface.data.tolist(), [0, 1, 2, 3, 4, 1, 6, 3, 4])
+
+pen = AbsInfo(0, 0, 20967, 0, 0, 100)
+assertv("_classify key", _classify({EV_KEY: frozenset([KEY_A])}, {}), "key")
+assertv(
+    "_classify wacom",
+    _classify(
+        {EV_ABS: frozenset([ABS_X]), EV_KEY: frozenset([BTN_STYLUS])}, {ABS_X: pen}
+    ),
+    "wacom",
+)
+assertv(
+    "_classify touch",
+    _classify(
+        {EV_ABS: frozenset([ABS_MT_TRACKING_ID])},
+        {ABS_MT_TRACKING_ID: AbsInfo(0, 0, 65535, 0, 0, 0)},
+    ),
+    "touch",
+)
+
+opened = []
+
+
+def opener(path):
+    opened.append(FakeDevice(path))
+    return opened[-1]
+
+
+with tempfile.TemporaryDirectory() as directory:
+    # Any character device will do, only the metadata comes from the opener
+    os.symlink("/dev/null", os.path.join(directory, "event0"))
+    registry = _Registry(directory, opener)
+    infos = registry.scan()
+    assertv("_Registry.scan", [x.type for x in infos], ["wacom"])
+    assertv("_Registry.scan cached", registry.scan() == infos, True)
+    assertv("_Registry.scan probes", len(opened), 1)
+    assertv("_Registry.scan probe closed", opened[0].fd, -1)
+    first = registry.openEach(infos)
+    second = registry.openEach(infos)
+    assertv("_Registry.openEach", first[0] is not second[0], True)
+    first[0].close()
+    # Closing one caller's device doesn't affect anyone else's
+    assertv("_Registry.get", registry.get(second[0]).type, "wacom")
+    assertv(
+        "_Registry.get cached",
+        registry.get(second[0]) is registry.get(second[0]),
+        True,
+    )
+    os.symlink("/dev/zero", os.path.join(directory, "event1"))
+    os.unlink(os.path.join(directory, "event0"))
+    assertv(
+        "_Registry.scan changed", [x.path[-6:] for x in registry.scan()], ["event1"]
+    )
+    second[0].close()
+    for x in registry.openEach(registry.scan()):
+        x.close()
+
+with tempfile.TemporaryDirectory() as directory:
+    registry = _Registry(directory, opener)
+    watcher = _watch(directory)
+    path = os.path.join(directory, "event0")
+    os.symlink("/dev/null", path)
+    os.symlink("/dev/null", os.path.join(directory, "mouse0"))
+    added, removed = _hotplug(watcher, {}, registry)
+    assertv("_hotplug added", ([x.path for x in added], removed), ([path], []))
+    registered = {path: added[0]}
+    os.unlink(path)
+    added, removed = _hotplug(watcher, registered, registry)
+    assertv("_hotplug removed", (added, removed), ([], [registered[path]]))
+    assertv("_hotplug forgotten", registry.devices, {})
+    registered[path].close()
+    watcher.close()
+
+states = _EventStates(Input)
+device = PEN_INFO.device
+events = [
+    (e.is_hover, e.is_down, e.was_down)
+    for x in pen_stream(5)
+    for e in states.feed(device, x, PEN_INFO)
+]
+assertv(
+    "_EventStates pen",
+    events,
+    [
+        (1, False, False),
+        (False, True, False),
+        (False, True, True),
+        (False, True, True),
+        (1, False, True),
+    ],
+)
+
+
+def snapshot(e):
+    return e.is_down, e.was_down, e.x, e.previousX, e.screenPos, e.previousScreenPos
+
+
+states = _EventStates(Input)
+live = [snapshot(e) for x in pen_stream(8) for e in states.feed(device, x, PEN_INFO)]
+states = _EventStates(Input)
+held = [e for x in pen_stream(8) for e in states.feed(device, x, PEN_INFO)]
+assertv("_EventStates held events", [snapshot(e) for e in held], live)
+event = next(states.feed(device, pen_stream(4)[2]))
+assertv("WacomEvent.x", round(event.x, 6), round(1000 / 20967, 6))
+assertv("WacomEvent.tilt", event.tilt, (0.5, 0.5))
+
+recording = os.path.join(tempfile.gettempdir(), "libremarkable-test.rec")
+with Recorder(recording) as recorder:
+    for x in pen_stream(5):
+        recorder.write(PEN_INFO, x)
+
+assertv(
+    "Input.replay",
+    [(e.is_hover, e.is_down, e.was_down) for e in Input.replay(recording, None)],
+    events,
+)
+os.unlink(recording)
+
+stream = pen_stream(8)
+coalesced = _coalesce(stream, True)
+assertv("_coalesce", [len(x) for x in coalesced], [3, 3, 6, 2])
+assertv("_coalesce last", coalesced[2][:-1], stream[-2][:-1])
+states = _EventStates(Input)
+events = [e for x in coalesced for e in states.feed(device, x, PEN_INFO)]
+assertv(
+    "WacomEvent.skippedScreenPos",
+    events[2].skippedScreenPos,
+    [PEN_INFO.transform(1000 + i * 7, 2000 + i * 3) for i in range(4)],
+)
+assertv("WacomEvent.screenPos", events[2].screenPos, PEN_INFO.transform(1028, 2012))
+assertv("WacomEvent.skippedScreenPos empty", events[3].skippedScreenPos, [])
+
+fake = FakeDevice()
+stream = pen_stream(100)
+fake.write([e for x in stream for e in x])
+reports = []
+for d, events in Input.rawEvents([fake], coalesce=True):
+    if d is None:
+        break
+
+    reports.append(events)
+
+assertv("Input.rawEvents coalesce", [len(x) for x in reports], [3, 3, 6, 2])
+assertv(
+    "Input.rawEvents coalesce last",
+    [(e.code, e.value) for e in reports[2]],
+    [(e.code, e.value) for e in stream[-2]],
+)
+fake.close()
+
+states = _EventStates(Input)
+for x in pen_stream(4)[:3]:
+    for e in states.feed(device, x, PEN_INFO):
+        pass
+
+resync = _Resync(
+    InputEvent(0, 0, type, code, value)
+    for type, code, value in [
+        (EV_KEY, BTN_TOOL_PEN, 0),
+        (EV_KEY, BTN_TOUCH, 0),
+        (EV_KEY, BTN_STYLUS, 0),
+        (EV_ABS, ABS_X, 1000),
+        (EV_ABS, ABS_Y, 2000),
+        (EV_SYN, SYN_REPORT, 0),
+    ]
+)
+events = [
+    (e.is_down, e.was_down, [(x.code, x.value) for x in e.rawEvents])
+    for e in states.feed(device, resync, PEN_INFO)
+]
+assertv("_Resync", events, [(False, True, [(BTN_TOOL_PEN, 0), (BTN_TOUCH, 0)])])
+assertv("_Resync unchanged", list(states.feed(device, resync, PEN_INFO)), [])
+
+reports = pen_stream(4)[:3] + [resync, resync]
+states = _EventStates(Input)
+live = [
+    (e.is_down, len(e.rawEvents))
+    for x in reports
+    for e in states.feed(device, x, PEN_INFO)
+]
+with Recorder(recording) as recorder:
+    for x in reports:
+        recorder.write(PEN_INFO, x)
+
+assertv(
+    "Input.replay resync",
+    [(e.is_down, len(e.rawEvents)) for e in Input.replay(recording, None)],
+    live,
+)
+os.unlink(recording)
+assertv("InputReader.drain", list(InputReader().drain(timeout=None)), [])
+
+stream = pen_stream(12)
+states = _EventStates(Input)
+expected = [snapshot(e) for x in stream for e in states.feed(device, x, PEN_INFO)]
+fake = FakeDevice()
+fake.write([e for x in stream for e in x])
+with InputReader([fake], capacity=4) as reader:
+    # The worker fills the ring, then waits for drain() to make room
+    for _ in range(500):
+        if reader.overflows:
+            break
+
+        threading.Event().wait(0.01)
+
+    assertv("InputReader full", (len(reader), reader.overflows), (4, 1))
+    # Batches are held as a whole before any of their events are read
+    batches = [list(reader.drain(max=3))]
+    assertv("InputReader.drain max", len(batches[0]), 3)
+    while sum(len(x) for x in batches) < len(expected):
+        batches.append(list(reader.drain(timeout=5)))
+
+    events = [snapshot(e) for x in batches for e in x]
+
+assertv("InputReader wrap-around", events, expected)
+assertv("InputReader stopped", (reader.running, len(reader)), (False, 0))
+
+reader = InputReader([fake])
+reader.start()
+waiter = threading.Thread(target=lambda: list(reader.drain(timeout=None)))
+waiter.start()
+reader.stop()
+waiter.join(5)
+assertv("InputReader.stop wakes", (waiter.is_alive(), reader.running), (False, False))
+fake.close()
+
+
+class BrokenDevice(FakeDevice):
+    def read(self):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+
+fake = BrokenDevice()
+fake.write(stream[0])
+reader = InputReader([fake])
+reader.start()
+try:
+    list(reader.drain(timeout=None))
+    error = None
+
+except OSError as e:
+    error = e.errno
+
+assertv("InputReader.drain error", error, errno.EIO)
+reader.stop()
+fake.close()
+
+
+async def read_async(fake, count):
+    reports = []
+    async with aclosing(Input.araw_events([fake])) as reports_async:
+        # Nothing is written until the reader is waiting on the loop
+        asyncio.get_running_loop().call_soon(fake.write, stream[0] + stream[1])
+        async for d, events in reports_async:
+            reports.append([(e.code, e.value) for e in events])
+            if len(reports) == count:
+                break
+
+    return reports, asyncio.get_running_loop().remove_reader(fake.fd)
+
+
+async def cancel_async(fake):
+    task = asyncio.create_task(anext(Input.araw_events([fake])))
+    await asyncio.sleep(0)
+    task.cancel()
+    try:
+        await task
+
+    except asyncio.CancelledError:
+        pass
+
+    return asyncio.get_running_loop().remove_reader(fake.fd)
+
+
+async def events_async(count):
+    events = []
+    async with aclosing(Input.aevents()) as events_async:
+        async for e in events_async:
+            events.append((e.is_down, e.x))
+            if len(events) == count:
+                break
+
+    return events
+
+
+fake = FakeDevice()
+reports, registered = asyncio.run(read_async(fake, 2))
+assertv(
+    "Input.araw_events",
+    reports,
+    [[(e.code, e.value) for e in x] for x in stream[:2]],
+)
+assertv("Input.araw_events closed", registered, False)
+assertv("Input.araw_events cancelled", asyncio.run(cancel_async(fake)), False)
+fake.close()
+
+fake = BrokenDevice()
+try:
+    asyncio.run(read_async(fake, 1))
+    error = None
+
+except OSError as e:
+    error = e.errno
+
+assertv("Input.araw_events error", error, errno.EIO)
+fake.close()
+
+stream = pen_stream(5)
+states = _EventStates(Input)
+expected = [(e.is_down, e.x) for x in stream for e in states.feed(device, x, PEN_INFO)]
+fake = FakeDevice()
+fake.write([e for x in stream for e in x])
+devices = Input.__dict__["devices"]
+Input.devices = classmethod(lambda cls: [fake])
+try:
+    assertv("Input.aevents", asyncio.run(events_async(len(expected))), expected)
+    # Devices it opened itself are closed once it is done
+    assertv("Input.aevents closed", fake.fd, -1)
+
+finally:
+    Input.devices = devices
+    fake.close()
+
+transform = ScreenTransform(
+    ScreenTransform._axis(1, 0, 100, 9, False),
+    ScreenTransform._axis(0, 0, 200, 19, True),
+)
+assertv("ScreenTransform", (transform(0, 0), transform(200, 100)), ((0, 19), (9, 0)))
+assertv("ScreenTransform.map", transform.map([0, 200], [0, 100]), ([0, 9], [19, 0]))
+
 if FAILED:
     sys.exit(1)